@@ -0,0 +1,156 @@
+import argparse
+import statistics
+import threading
+import time
+
+import tracing
+from bot import run_visit
+from calibration import calibrate
+from inputs import FakeInputBackend, InputDispatcher
+from screens import load_screen_table
+from stats import Stats
+from vision import Frame, ReplaySource, set_frame_source
+from watcher import ScreenWatcher
+
+
+# Headless benchmark: replays a recording through the vision layer and the real visit loop with a fake input
+# backend, then reports detection latency per screen, probe throughput and visit cycle time.
+#
+#   python bench.py recording.npz
+#   python bench.py frames_dir --fps 30 --speed 2
+
+
+class TimedWatcher(ScreenWatcher):
+
+
+    def __init__(self, table, interval_sec=None):
+        if interval_sec is None:
+            super().__init__(table)
+        else:
+            super().__init__(table, interval_sec)
+        self.detections = []
+
+
+    def wait_for(self, states, timeout=None, watch=()):
+        seen = super().wait_for(states, timeout=timeout, watch=watch)
+        if seen:
+            targets = (states,) if isinstance(states, str) else tuple(states)
+            self.detections.append((time.monotonic(), seen.intersection(targets)))
+        return seen
+
+
+def classify_frames(source, table):
+    # Ground truth: the set of screens visible in every recorded frame.
+    names = list(table.screens)
+    ps = table.probe_set(names)
+    truth = []
+    for i in range(source.count):
+        results = ps.evaluate(Frame(array=source.load(i)))
+        truth.append({n for n in names if table.screens[n].evaluate(results)})
+    return truth
+
+
+def onsets(truth):
+    # {state: [frame indices where the state became visible]}
+    out = {}
+    prev = set()
+    for i, states in enumerate(truth):
+        for s in states - prev:
+            out.setdefault(s, []).append(i)
+        prev = states
+    return out
+
+
+def bench_probes(source, table, iters):
+    ps = table.probe_set(list(table.screens))
+    left, top, width, height = ps.region
+    frames = [source.load(i) for i in range(min(source.count, 16))]
+    t0 = time.perf_counter()
+    for k in range(iters):
+        arr = frames[k % len(frames)]
+        ps.evaluate(Frame(array=arr[top:top + height, left:left + width], left=left, top=top))
+    elapsed = time.perf_counter() - t0
+    return iters / elapsed, iters * len(ps.probes) / elapsed
+
+
+def summarize(values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return (f"n={len(values)} mean={statistics.mean(values) * 1000:.1f}ms "
+            f"p50={statistics.median(values) * 1000:.1f}ms p95={p95 * 1000:.1f}ms max={values[-1] * 1000:.1f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a recording through the detection loop and report latency.")
+    ap.add_argument("recording", help="PNG directory or .npz archive")
+    ap.add_argument("--fps", type=float, default=30.0, help="playback rate for PNG directories")
+    ap.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier")
+    ap.add_argument("--visits", type=int, default=0, help="stop after this many visits (0 = end of recording)")
+    ap.add_argument("--probe-iters", type=int, default=2000)
+    ap.add_argument("--interval-ms", type=float, default=None, help="override WATCH_INTERVAL_MS")
+    ap.add_argument("--trace", metavar="PATH", help="record spans and write a Chrome trace-event JSON file")
+    args = ap.parse_args()
+    if args.trace:
+        tracing.enable()
+
+    source = ReplaySource(args.recording, fps=args.fps, speed=args.speed)
+    table = calibrate(load_screen_table(), source)
+
+    truth = classify_frames(source, table)
+    starts = onsets(truth)
+    grabs_per_sec, probes_per_sec = bench_probes(source, table, args.probe_iters)
+
+    set_frame_source(source)
+    backend = FakeInputBackend()
+    dispatcher = InputDispatcher(backend)
+    dispatcher.start()
+    watcher = TimedWatcher(table, None if args.interval_ms is None else args.interval_ms / 1000.0)
+    watcher.start()
+    stats = Stats(milestone=0)
+
+    def _stop_at_end():
+        while not source.finished:
+            time.sleep(0.05)
+        watcher.stop()
+
+    threading.Thread(target=_stop_at_end, daemon=True, name="bench-eof").start()
+
+    outcomes = {}
+    cycles = []
+    while not args.visits or len(cycles) < args.visits:
+        t0 = time.monotonic()
+        result = run_visit(table, watcher, dispatcher, stats)
+        if result is None:
+            break
+        cycles.append(time.monotonic() - t0)
+        outcomes[result] = outcomes.get(result, 0) + 1
+        if result == "success":
+            break
+    watcher.stop()
+    dispatcher.stop()
+
+    latencies = {}
+    for t, states in watcher.detections:
+        for s in states:
+            # latest onset of this state presented at or before the detection
+            cands = [source.frame_time(i) for i in starts.get(s, ())]
+            cands = [ft for ft in cands if ft is not None and ft <= t]
+            if cands:
+                latencies.setdefault(s, []).append(t - max(cands))
+
+    print(f"recording: {source.count} frames, {args.recording}")
+    print(f"probe matching: {grabs_per_sec:,.0f} probe-set evals/s, {probes_per_sec:,.0f} probes/s")
+    for s in sorted(latencies):
+        print(f"detect {s:<12} {summarize(latencies[s])}")
+    if cycles:
+        print(f"visit cycle    {summarize(cycles)}")
+    for name, p in stats.snapshot()["phase_latency_ms"].items():
+        print(f"phase {name:<13} n={p['count']} p50={p['p50_ms']}ms p99={p['p99_ms']}ms")
+    print(f"outcomes: {outcomes or '{}'}  keys sent: {len(backend.keys)}")
+    if args.trace:
+        print(f"trace: {tracing.summary_line()}")
+        print(f"wrote {tracing.export_chrome(args.trace)} trace events to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
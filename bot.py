@@ -0,0 +1,101 @@
+import logging
+import time
+
+from config import BUY_OPEN_TIMEOUT, PURCHASE_RESULT_TIMEOUT
+from logutil import clog
+from tracing import span
+
+
+def run_visit(table, watcher, dispatcher, stats):
+    # One MAIN -> auction house -> back cycle. Returns "no_sale", "unavailable", "failed", "success",
+    # or None if the watcher was stopped.
+    stats.mark_enter_main()
+    clog(logging.DEBUG, "DETECT", "Waiting for MAIN screen...")
+
+    # Loop until the main screen is detected
+    with stats.phase("wait_main"):
+        seen = watcher.wait_for("MAIN")
+    if not seen:
+        return None
+
+    # On the main screen, press Enter twice
+    clog(logging.INFO, "DETECT", "MAIN screen detected.")
+    with span("sleep.settle"):
+        time.sleep(1)
+    # Wait until no lag is detected; the sale marker is sampled in the same frames.
+    # Remaining Enter presses are dropped as soon as the auction screen is up.
+    clog(logging.DEBUG, "DETECT", "Waiting for NO-LAG state...")
+    with stats.phase("wait_no_lag"):
+        seen = dispatcher.send_until(table.macro("MAIN", "enter_auction"), watcher,
+                                     table.successors["MAIN"], watch=table.watched["MAIN"])
+    if not seen:
+        return None
+    clog(logging.INFO, "DETECT", "NO-LAG state detected.")
+
+    # If no car is on sale, press Esc to return to the main screen
+    if "ON_SALE" not in seen:
+        stats.mark_no_sale()
+        clog(logging.INFO, "DETECT", "No car on sale. Returning to MAIN (Esc).")
+        dispatcher.send(table.macro("NO_LAG", "leave"))
+        return "no_sale"
+
+    clog(logging.INFO, "DETECT", "CAR ON SALE detected.")
+    stats.mark_first_sale_seen()
+
+    # If available, keep pressing Y until the buying screen shows; the presses stop on the first confirming frame
+    with stats.phase("sale_check"):
+        if watcher.sample("BUY_PROMPT"):
+            seen = dispatcher.send_until(table.macro("BUY_PROMPT", "open"), watcher, table.successors["BUY_PROMPT"],
+                                         timeout=BUY_OPEN_TIMEOUT, repeat=True)
+            if not seen and watcher.stopped:
+                return None
+            ready = bool(seen) and "BUY_READY" in seen
+        else:
+            ready = "BUY_READY" in watcher.sample("BUY_READY")
+
+    # Try to buy
+    if not ready:
+        clog(logging.WARNING, "BUY", "Car unavailable, back to MAIN.")
+        dispatcher.send(table.macro("BUY_READY", "abort")).wait()
+        stats.mark_purchase_attempt()
+        stats.mark_purchase_failure()
+        return "unavailable"
+
+    stats.mark_purchase_attempt()
+    clog(logging.INFO, "BUY", "Proceeding to BUY: navigating and confirming...")
+    t0 = time.monotonic()
+    buy = dispatcher.send(table.macro("BUY_READY", "buy"))
+
+    # Watch every declared result screen and leave as soon as one shows up; the timeout is only a ceiling
+    clog(logging.DEBUG, "BUY", "Waiting for purchase result...")
+    with stats.phase("result"):
+        seen = watcher.wait_next("BUY_READY", timeout=PURCHASE_RESULT_TIMEOUT)
+    buy.wait()
+    stats.record_phase("buy", buy.finished_at - t0)
+    stats.mark_purchase_result(time.monotonic() - t0 if seen else None)
+    if not seen:
+        clog(logging.WARNING, "BUY", "No purchase result within %ss.", PURCHASE_RESULT_TIMEOUT)
+
+    # Failed buying, exit to main screen and try again
+    if not seen or "BUY_SUCCESS" not in seen:
+        clog(logging.WARNING, "BUY", "Buying failed. Back to MAIN...")
+        stats.mark_purchase_failure()
+        dispatcher.send(table.macro("BUY_READY", "dismiss_failure")).wait()
+        return "failed"
+
+    clog(logging.INFO, "BUY", "Buying SUCCESS. Doing final navigation and notification...")
+    dispatcher.send(table.macro("BUY_SUCCESS", "finish")).wait()
+    return "success"
+
+
+def run_until_success(table, watcher, dispatcher, stats, scheduler=None):
+    # Keep visiting, paced by the optional AdaptiveScheduler, until a purchase succeeds. Returns "success", or
+    # None if the watcher was stopped.
+    while True:
+        delay = scheduler.before_visit() if scheduler else 0
+        if delay:
+            with span("sleep.pace"):
+                time.sleep(delay)
+        result = run_visit(table, watcher, dispatcher, stats)
+        if result in ("success", None):
+            return result
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from config import CALIBRATION_FILE, CALIBRATION_SEARCH_RADIUS
+from logutil import clog
+from vision import get_frame_source
+
+
+class Transform:
+
+
+    def __init__(self, sx=1.0, sy=1.0, ox=0.0, oy=0.0):
+        self.sx = sx
+        self.sy = sy
+        self.ox = ox
+        self.oy = oy
+
+
+    def apply(self, x, y):
+        return int(round(x * self.sx + self.ox)), int(round(y * self.sy + self.oy))
+
+
+    def to_dict(self):
+        return {"sx": self.sx, "sy": self.sy, "ox": self.ox, "oy": self.oy}
+
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(float(d["sx"]), float(d["sy"]), float(d["ox"]), float(d["oy"]))
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        clog(logging.WARNING, "DETECT", f"calibration cache unreadable, ignoring: {e}")
+        return {}
+
+
+def _save_cache(path, cache):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _locate(frame, x, y, color, radius):
+    # Nearest pixel of `color` within `radius` of (x, y), or None.
+    arr = frame.array
+    h, w = arr.shape[:2]
+    x0, y0 = max(0, x - radius), max(0, y - radius)
+    x1, y1 = min(w, x + radius + 1), min(h, y + radius + 1)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    hits = np.argwhere(np.all(arr[y0:y1, x0:x1] == np.array(color, dtype=arr.dtype), axis=2))
+    if not hits.size:
+        return None
+    hits += (y0, x0)
+    d = (hits[:, 0] - y) ** 2 + (hits[:, 1] - x) ** 2
+    py, px = hits[int(np.argmin(d))]
+    return int(px), int(py)
+
+
+def _fit(pairs, scale):
+    # Least-squares fit of found = ref * s + o per axis; falls back to the geometric scale with a mean offset.
+    (ref, found) = zip(*pairs)
+    n = len(pairs)
+    mr = sum(ref) / n
+    mf = sum(found) / n
+    var = sum((r - mr) ** 2 for r in ref)
+    if n >= 2 and var > 0:
+        scale = sum((r - mr) * (f - mf) for r, f in pairs) / var
+    return scale, mf - mr * scale
+
+
+def calibrate(table, source=None, path=CALIBRATION_FILE, radius=CALIBRATION_SEARCH_RADIUS, region=None):
+    # Compute (or load) the reference-to-display transform for `table` and return the transformed table.
+    # With `region` (left, top, width, height) the game is calibrated inside that part of the display; the cache
+    # stays region-relative and the region offset is added to the returned transform.
+    source = source or get_frame_source()
+    if region is None:
+        width, height = source.size()
+        dx = dy = 0
+    else:
+        dx, dy, width, height = region
+    key = f"{width}x{height}"
+    ref_w, ref_h = table.reference
+
+    def _placed(t):
+        return table.transformed(Transform(t.sx, t.sy, t.ox + dx, t.oy + dy))
+
+    if not ref_w or not ref_h or (ref_w, ref_h) == (width, height):
+        return _placed(Transform()) if dx or dy else table
+
+    cache = _load_cache(path)
+    if key in cache:
+        clog(logging.INFO, "DETECT", f"calibration loaded from cache for {key}")
+        return _placed(Transform.from_dict(cache[key]))
+
+    sx, sy = width / ref_w, height / ref_h
+    frame = source.grab(region)
+    xs, ys = [], []
+    for name in table.anchors:
+        x, y, color = table.probe(name)
+        guess = (int(round(x * sx)), int(round(y * sy)))
+        found = _locate(frame, guess[0], guess[1], color, radius)
+        if found is None:
+            clog(logging.WARNING, "DETECT", f"calibration anchor {name!r} not found near {guess}")
+            continue
+        xs.append((x, found[0]))
+        ys.append((y, found[1]))
+
+    if not xs:
+        # Scale-only guess is used for this run but not cached, so the next launch retries the anchors.
+        clog(logging.WARNING, "DETECT", f"no anchors located, using plain scaling for {key}")
+        return _placed(Transform(sx, sy))
+
+    sx, ox = _fit(xs, sx)
+    sy, oy = _fit(ys, sy)
+    transform = Transform(sx, sy, ox, oy)
+    cache[key] = dict(transform.to_dict(), created_at=time.time())
+    try:
+        _save_cache(path, cache)
+    except OSError as e:
+        clog(logging.WARNING, "DETECT", f"failed to write calibration cache: {e}")
+    clog(logging.INFO, "DETECT", f"calibrated {key}: scale=({sx:.4f}, {sy:.4f}) offset=({ox:.1f}, {oy:.1f})")
+    return _placed(transform)
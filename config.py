@@ -6,10 +6,97 @@ from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env")
 MAIL_USER = os.getenv("MAIL_USER")
 MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
-if not MAIL_USER or not MAIL_PASSWORD:
-    raise ValueError("MAIL_USER and MAIL_PASSWORD must be set in the .env file")
+
+
+def require_mail_credentials():
+    # Checked when the email pipeline starts rather than at import, so --no-email runs need no credentials.
+    if not MAIL_USER or not MAIL_PASSWORD:
+        raise ValueError("MAIL_USER and MAIL_PASSWORD must be set in the .env file")
+
 
 OUTBOX_DIR = os.getenv("OUTBOX_DIR", "outbox")
 EMAIL_SCAN_INTERVAL = int(os.getenv("EMAIL_SCAN_INTERVAL", "60"))
 STATS_LOG_INTERVAL = int(os.getenv("STATS_LOG_INTERVAL", "30"))
 STATS_MILESTONE = int(os.getenv("STATS_MILESTONE", "300"))
+
+# Screen capture backend: "mss" (persistent session), "pyautogui", or "replay" (PNG directory or .npz in REPLAY_DIR)
+FRAME_SOURCE = os.getenv("FRAME_SOURCE", "mss").lower()
+REPLAY_DIR = os.getenv("REPLAY_DIR", "replay")
+# Replay playback rate for PNG directories; 0 advances one frame per grab
+REPLAY_FPS = float(os.getenv("REPLAY_FPS", "0"))
+WATCH_INTERVAL_MS = int(os.getenv("WATCH_INTERVAL_MS", "20"))
+SCREENS_FILE = os.getenv("SCREENS_FILE", "screens.json")
+CALIBRATION_FILE = os.getenv("CALIBRATION_FILE", "calibration.json")
+CALIBRATION_SEARCH_RADIUS = int(os.getenv("CALIBRATION_SEARCH_RADIUS", "24"))
+# Default probe matching: square of (2*radius+1)^2 pixels, per-channel tolerance, fraction of pixels that must match
+PROBE_RADIUS = int(os.getenv("PROBE_RADIUS", "2"))
+PROBE_TOLERANCE = int(os.getenv("PROBE_TOLERANCE", "8"))
+PROBE_MIN_FRACTION = float(os.getenv("PROBE_MIN_FRACTION", "0.8"))
+# Key input backend: "keyboard" (low-level, no pause), "pyautogui", or "fake" (records keys, for replay)
+INPUT_BACKEND = os.getenv("INPUT_BACKEND", "keyboard").lower()
+PURCHASE_RESULT_TIMEOUT = float(os.getenv("PURCHASE_RESULT_TIMEOUT", "10"))
+# Ceiling on pressing Y at the buy prompt while waiting for the buy screen; presses stop as soon as it shows
+BUY_OPEN_TIMEOUT = float(os.getenv("BUY_OPEN_TIMEOUT", "5"))
+# Opt-in post-mortem frame recorder: last RECORDER_SECONDS of frames, downscaled by RECORDER_SCALE; 0 disables it.
+# It takes full-screen grabs next to the probe loop, and on replay sources it advances the shared frame cursor.
+RECORDER_SECONDS = float(os.getenv("RECORDER_SECONDS", "0"))
+RECORDER_FPS = float(os.getenv("RECORDER_FPS", "5"))
+RECORDER_SCALE = int(os.getenv("RECORDER_SCALE", "4"))
+RECORDER_FILE = os.getenv("RECORDER_FILE", "recorder.ring")
+RECORDER_DUMP_DIR = os.getenv("RECORDER_DUMP_DIR", "postmortem")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.qq.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1").lower() not in ("0", "false", "no")
+# Pooled SMTP session: closed after SMTP_IDLE_TIMEOUT seconds idle, NOOP every SMTP_KEEPALIVE seconds until then
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "120"))
+SMTP_KEEPALIVE = float(os.getenv("SMTP_KEEPALIVE", "30"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+OUTBOX_FSYNC_INTERVAL = float(os.getenv("OUTBOX_FSYNC_INTERVAL", "1.0"))
+OUTBOX_COMPACT_MIN = int(os.getenv("OUTBOX_COMPACT_MIN", "256"))
+# Email retry: exponential backoff with jitter per job; the breaker pauses sends after consecutive failures
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", "15"))
+EMAIL_BACKOFF_MAX = float(os.getenv("EMAIL_BACKOFF_MAX", "1800"))
+EMAIL_BREAKER_THRESHOLD = int(os.getenv("EMAIL_BREAKER_THRESHOLD", "5"))
+EMAIL_BREAKER_COOLDOWN = float(os.getenv("EMAIL_BREAKER_COOLDOWN", "120"))
+# Success screenshot: downscaled to SCREENSHOT_MAX_WIDTH and compressed under SCREENSHOT_MAX_BYTES
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "JPEG").upper()
+SCREENSHOT_MAX_WIDTH = int(os.getenv("SCREENSHOT_MAX_WIDTH", "1280"))
+SCREENSHOT_MAX_BYTES = int(os.getenv("SCREENSHOT_MAX_BYTES", "300000"))
+# Milestone emails are merged into one digest at most every STATS_EMAIL_MIN_INTERVAL seconds
+STATS_EMAIL_MIN_INTERVAL = float(os.getenv("STATS_EMAIL_MIN_INTERVAL", "600"))
+# Opt-in HTTP status endpoint (/metrics OpenMetrics, /status JSON); 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_BIND = os.getenv("METRICS_BIND", "127.0.0.1")
+METRICS_REFRESH = float(os.getenv("METRICS_REFRESH", "2"))
+# Stats persistence: checkpoint every STATS_CHECKPOINT_INTERVAL seconds, sale event log trimmed to STATS_EVENTS_KEEP
+STATS_STATE_FILE = os.getenv("STATS_STATE_FILE", "stats_state.json")
+STATS_EVENTS_FILE = os.getenv("STATS_EVENTS_FILE", "sale_events.log")
+STATS_CHECKPOINT_INTERVAL = float(os.getenv("STATS_CHECKPOINT_INTERVAL", "60"))
+STATS_EVENTS_KEEP = int(os.getenv("STATS_EVENTS_KEEP", "10000"))
+# Sale-timing predictor: needs PREDICT_MIN_SALES listings; outside predicted windows visits are spaced by
+# PREDICT_IDLE_DELAY seconds and the watcher samples every PREDICT_IDLE_WATCH_MS
+PREDICT_MIN_SALES = int(os.getenv("PREDICT_MIN_SALES", "8"))
+PREDICT_DEDUPE_SEC = float(os.getenv("PREDICT_DEDUPE_SEC", "120"))
+PREDICT_BUCKET_MIN = int(os.getenv("PREDICT_BUCKET_MIN", "30"))
+PREDICT_IDLE_DELAY = float(os.getenv("PREDICT_IDLE_DELAY", "5"))
+PREDICT_IDLE_WATCH_MS = int(os.getenv("PREDICT_IDLE_WATCH_MS", "100"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+# Optional rotating log file written by the logging listener thread
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", "5"))
+# Multi-session supervisor: session list, how long one shared capture may be reused, pause after focusing a window
+SESSIONS_FILE = os.getenv("SESSIONS_FILE", "sessions.json")
+SHARED_CAPTURE_MAX_AGE_MS = float(os.getenv("SHARED_CAPTURE_MAX_AGE_MS", "15"))
+WINDOW_FOCUS_DELAY = float(os.getenv("WINDOW_FOCUS_DELAY", "0.05"))
+# Shutdown budgets (seconds): stopping detection, delivering queued email before the rest is spilled to the outbox,
+# and a hard ceiling after which the process exits regardless
+SHUTDOWN_DETECT_BUDGET = float(os.getenv("SHUTDOWN_DETECT_BUDGET", "1"))
+SHUTDOWN_EMAIL_BUDGET = float(os.getenv("SHUTDOWN_EMAIL_BUDGET", "5"))
+SHUTDOWN_DEADLINE = float(os.getenv("SHUTDOWN_DEADLINE", "15"))
+# Opt-in span tracing of captures, key sends and visit phases; TRACE_FILE (Chrome trace-event JSON) is written on exit
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0").lower() in ("1", "true", "yes")
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "65536"))
+TRACE_FILE = os.getenv("TRACE_FILE", "trace.json")
@@ -1,141 +1,394 @@
-import json
+import collections
+import email.policy
+import itertools
 import logging
 import os
 import queue
+import random
 import smtplib
+import tempfile
 import threading
 import time
-from datetime import datetime
+import uuid
+from email.generator import BytesGenerator
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from config import MAIL_PASSWORD, MAIL_USER, EMAIL_SCAN_INTERVAL, OUTBOX_DIR
+from config import (EMAIL_BACKOFF_BASE, EMAIL_BACKOFF_MAX, EMAIL_BATCH_SIZE, EMAIL_BREAKER_COOLDOWN,
+                    EMAIL_BREAKER_THRESHOLD, EMAIL_SCAN_INTERVAL, MAIL_PASSWORD, MAIL_USER, OUTBOX_DIR, SMTP_HOST,
+                    SMTP_IDLE_TIMEOUT, SMTP_KEEPALIVE, SMTP_PORT, SMTP_SSL)
+from imaging import encode_screenshot
 from logutil import clog
+from outbox import Outbox
+
+
+# Lower sorts first: success notifications preempt stats milestones.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
 
 
 class EmailJob:
 
 
-    def __init__(self, to_addr, subject, html_body, screenshot_path=None):
+    def __init__(self, to_addr, subject, html_body, screenshot_path=None, job_id=None, created_at=None,
+                 priority=PRIORITY_NORMAL, attempts=0, next_attempt_at=0.0):
         self.to_addr = to_addr
         self.subject = subject
         self.html_body = html_body
         self.screenshot_path = screenshot_path
-        self.created_at = time.time()
+        self.id = job_id or uuid.uuid4().hex
+        self.created_at = created_at or time.time()
+        self.priority = priority
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+
+
+    def to_dict(self):
+        return {
+            "to_addr": self.to_addr,
+            "subject": self.subject,
+            "html_body": self.html_body,
+            "screenshot_path": self.screenshot_path,
+            "created_at": self.created_at,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "next_attempt_at": self.next_attempt_at,
+        }
+
+
+    @classmethod
+    def from_dict(cls, job_id, data):
+        created_at = data.get("created_at")
+        return cls(
+            to_addr=data.get("to_addr"),
+            subject=data.get("subject"),
+            html_body=data.get("html_body"),
+            screenshot_path=data.get("screenshot_path") or None,
+            job_id=job_id,
+            # legacy cache files stored an ISO string
+            created_at=created_at if isinstance(created_at, (int, float)) else None,
+            priority=data.get("priority", PRIORITY_NORMAL),
+            attempts=data.get("attempts", 0),
+            next_attempt_at=data.get("next_attempt_at", 0.0),
+        )
 
 
 class EmailSender:
 
 
     def __init__(self, user=MAIL_USER, password=MAIL_PASSWORD, retry_dir=OUTBOX_DIR, scan_interval=EMAIL_SCAN_INTERVAL,
-                 max_queue=1000):
+                 max_queue=1000, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL, idle_timeout=SMTP_IDLE_TIMEOUT,
+                 keepalive=SMTP_KEEPALIVE, batch_size=EMAIL_BATCH_SIZE, backoff_base=EMAIL_BACKOFF_BASE,
+                 backoff_max=EMAIL_BACKOFF_MAX, breaker_threshold=EMAIL_BREAKER_THRESHOLD,
+                 breaker_cooldown=EMAIL_BREAKER_COOLDOWN):
         self.user = user
         self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.batch_size = max(1, batch_size)
+        # Only the worker thread touches the connection.
+        self._server = None
+        self._last_used = 0.0
+        self._last_noop = 0.0
         self.retry_dir = retry_dir
         self.scan_interval = scan_interval
-        self.queue = queue.Queue(maxsize=max_queue)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown = breaker_cooldown
+        # Circuit breaker state, written by the worker only.
+        self._failures = 0
+        self._breaker_until = 0.0
+        # Entries are (priority, seq, job); seq keeps FIFO order within a priority.
+        self.queue = queue.PriorityQueue(maxsize=max_queue)
+        self._seq = itertools.count()
+        self._wake = threading.Event()
         self.stop_event = threading.Event()
-        os.makedirs(self.retry_dir, exist_ok=True)
+        # set by shutdown(): the scanner stops re-queueing journaled retries while the queue drains
+        self._draining = threading.Event()
+        # the worker's current batch and the job being sent, shared with shutdown() under _batch_lock
+        self._batch = collections.deque()
+        self._current = None
+        self._batch_lock = threading.Lock()
+        # the job the encoder has taken off _encode_queue and not yet queued for sending
+        self._encoding = None
+        self.outbox = Outbox(self.retry_dir)
+        # ids of journaled jobs currently queued or being sent, so the scanner doesn't queue them twice
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
 
+        self._encode_queue = queue.Queue()
+        self.encoder = threading.Thread(target=self._encoder_loop, daemon=True, name="email-encoder")
         self.worker = threading.Thread(target=self._worker_loop, daemon=True, name="email-worker")
         self.scanner = threading.Thread(target=self._scan_loop, daemon=True, name="email-retry-scanner")
 
 
     def start(self):
+        self.encoder.start()
         self.worker.start()
         self.scanner.start()
 
 
     def shutdown(self, wait_seconds=5.0):
-        self.stop_event.set()
-        try:
-            self.queue.join()
-        except Exception:
-            pass
-        t0 = time.time()
-        while not self.queue.empty() and (time.time() - t0) < wait_seconds:
+        # Bounded drain: the worker gets until the deadline to deliver what is queued, then everything still
+        # unsent (queued, awaiting encoding, or stuck in a send) is spilled to the outbox in one journal write.
+        # Returns the number of jobs spilled.
+        deadline = time.monotonic() + wait_seconds
+        self._draining.set()
+        self._wake.set()
+        while (self.worker.is_alive() and time.monotonic() < deadline
+               and (self._encode_queue.unfinished_tasks or self.queue.unfinished_tasks)):
             time.sleep(0.05)
+        self.stop_event.set()
+        if self.worker.is_alive():
+            self.worker.join(max(0.0, deadline - time.monotonic()))
+        jobs = self._take_unsent()
+        if jobs:
+            now = time.time()
+            for job in jobs:
+                job.next_attempt_at = now
+            try:
+                self.outbox.put_many((job.id, job.to_dict()) for job in jobs)
+                clog(logging.INFO, "EMAIL", "spilled %d unsent job(s) to the outbox", len(jobs))
+            except Exception as e:
+                clog(logging.ERROR, "EMAIL", "failed to spill unsent jobs: %s", e)
+        self.outbox.sync(force=True)
+        return len(jobs)
+
+
+    def _take_unsent(self):
+        # Jobs the worker will not deliver; journaled retries are already durable and are skipped.
+        with self._batch_lock:
+            jobs = list(self._batch)
+            self._batch.clear()
+            if self._current is not None and self.worker.is_alive():
+                # a send still blocked past the deadline may yet succeed; a duplicate beats a lost notification
+                jobs.insert(0, self._current)
+            if self._encoding is not None:
+                jobs.append(self._encoding)
+        while True:
+            try:
+                jobs.append(self.queue.get_nowait()[2])
+            except queue.Empty:
+                break
+            self.queue.task_done()
+        while True:
+            try:
+                job, _ = self._encode_queue.get_nowait()
+            except queue.Empty:
+                break
+            # the screenshot is lost with the process, the notification is not
+            jobs.append(job)
+            self._encode_queue.task_done()
+        with self._inflight_lock:
+            return [job for job in jobs if job.id not in self._inflight]
+
+
+    def status(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "encode_pending": self._encode_queue.qsize(),
+            "outbox_pending": len(self.outbox),
+            "consecutive_failures": self._failures,
+            "breaker_open": time.time() < self._breaker_until,
+        }
 
 
     def send_async(self, job: EmailJob):
         try:
-            self.queue.put_nowait(job)
+            self._enqueue(job)
             fname = os.path.basename(job.screenshot_path) if job.screenshot_path else "(no attachment)"
             clog(logging.INFO, "EMAIL", f"queued: {fname}")
         except queue.Full:
             clog(logging.WARNING, "EMAIL", "queue full, fallback to cache on disk")
-            self._cache_to_disk(job)
+            self._defer(job, time.time())
+
+
+    def send_async_with_image(self, job: EmailJob, image):
+        # Hand over an in-memory PIL image; it is downscaled/compressed on the encoder thread, written next to the
+        # outbox and attached as job.screenshot_path before the job is queued.
+        self._encode_queue.put((job, image))
+
+
+    def _encoder_loop(self):
+        while True:
+            job, image = self._encode_queue.get()
+            with self._batch_lock:
+                self._encoding = job
+            try:
+                data, ext = encode_screenshot(image)
+                path = os.path.join(self.retry_dir, f"screenshot_{int(time.time() * 1000)}.{ext}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                job.screenshot_path = path
+                clog(logging.DEBUG, "EMAIL", "encoded screenshot: %.0f KiB", len(data) / 1024)
+            except Exception as e:
+                clog(logging.ERROR, "EMAIL", f"screenshot encoding failed, sending without it: {e}")
+            finally:
+                del image
+            try:
+                if self.stop_event.is_set():
+                    # the worker is gone; shutdown() may already have spilled this job, and the outbox keeps one
+                    # entry per id either way
+                    self._defer(job, time.time())
+                else:
+                    self.send_async(job)
+            finally:
+                with self._batch_lock:
+                    self._encoding = None
+                self._encode_queue.task_done()
+
+
+    def _enqueue(self, job: EmailJob):
+        self.queue.put_nowait((job.priority, next(self._seq), job))
 
 
     def _worker_loop(self):
         while not self.stop_event.is_set():
             try:
-                job = self.queue.get(timeout=0.2)
+                _, _, job = self.queue.get(timeout=0.2)
             except queue.Empty:
+                self._idle_tick()
                 if self.stop_event.is_set():
                     break
                 continue
-            try:
-                self._send(job)
-                if job.screenshot_path and os.path.exists(job.screenshot_path):
-                    os.remove(job.screenshot_path)
-                clog(logging.INFO, "EMAIL", "sent successfully")
-            except Exception as e:
-                clog(logging.ERROR, "EMAIL", f"send failed: {e}")
-                self._cache_to_disk(job)
-            finally:
-                self.queue.task_done()
+            # Drain whatever else is already queued and deliver it over the same session. The batch lives on
+            # self so shutdown() can spill what the worker has not reached.
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait()[2])
+                except queue.Empty:
+                    break
+            with self._batch_lock:
+                self._batch.extend(batch)
+            while True:
+                with self._batch_lock:
+                    if not self._batch or self.stop_event.is_set():
+                        break
+                    job = self._current = self._batch.popleft()
+                if time.time() < self._breaker_until:
+                    # Breaker open: park the job in the outbox without spending an attempt on it.
+                    self._defer(job, self._breaker_until)
+                    self._current = None
+                    self.queue.task_done()
+                    continue
+                try:
+                    self._send(job)
+                    recovered = self._failures >= self.breaker_threshold
+                    # reset before waking the scanner, which reads _failures to decide on a half-open probe
+                    self._failures = 0
+                    if recovered:
+                        clog(logging.INFO, "EMAIL", "SMTP recovered, resuming cached jobs")
+                        self._wake.set()
+                    self._complete(job)
+                    if job.screenshot_path and os.path.exists(job.screenshot_path):
+                        os.remove(job.screenshot_path)
+                    clog(logging.INFO, "EMAIL", "sent successfully")
+                except Exception as e:
+                    clog(logging.ERROR, "EMAIL", f"send failed: {e}")
+                    self._failures += 1
+                    if self._failures >= self.breaker_threshold:
+                        self._breaker_until = time.time() + self.breaker_cooldown
+                        clog(logging.WARNING, "EMAIL",
+                             f"{self._failures} consecutive failures, pausing sends for {self.breaker_cooldown:.0f}s")
+                    self._cache_to_disk(job)
+                finally:
+                    self._current = None
+                    self.queue.task_done()
+            self.outbox.sync(force=False)
+        self._close_connection()
 
 
     def _scan_loop(self):
-        while not self.stop_event.is_set():
+        # Re-queue journaled jobs whose backoff has expired, highest priority first, straight from the outbox's
+        # in-memory index. Sleeps until the next job is due (at most scan_interval).
+        while not self.stop_event.is_set() and not self._draining.is_set():
+            # cleared before scanning, so a wake arriving mid-scan triggers another pass instead of being lost
+            self._wake.clear()
+            wake_in = self.scan_interval
             try:
-                for name in os.listdir(self.retry_dir):
-                    if not name.endswith(".json"):
-                        continue
-                    meta_path = os.path.join(self.retry_dir, name)
-                    with open(meta_path, "r", encoding="utf-8") as f:
-                        meta = json.load(f)
-                    shot_path = meta.get("screenshot_path")
-                    job = EmailJob(
-                        to_addr=meta.get("to_addr"),
-                        subject=meta.get("subject"),
-                        html_body=meta.get("html_body"),
-                        screenshot_path=shot_path if shot_path else None
-                    )
-                    try:
-                        self.queue.put_nowait(job)
-                        os.remove(meta_path)
-                        clog(logging.DEBUG, "EMAIL",
-                             f"re-queued cached job: {os.path.basename(shot_path) if shot_path else '(no attachment)'}")
-                    except queue.Full:
-                        clog(logging.WARNING, "EMAIL", "queue still full, keep cached")
+                now = time.time()
+                if now < self._breaker_until:
+                    wake_in = min(wake_in, self._breaker_until - now)
+                else:
+                    due, later = [], []
+                    with self._inflight_lock:
+                        for job_id, data in self.outbox.pending().items():
+                            if job_id in self._inflight:
+                                continue
+                            next_at = data.get("next_attempt_at", 0.0)
+                            if next_at <= now:
+                                due.append((data.get("priority", PRIORITY_NORMAL), next_at, job_id, data))
+                            else:
+                                later.append(next_at)
+                    due.sort(key=lambda d: d[:2])
+                    if self._failures >= self.breaker_threshold:
+                        # half-open: a single probe job decides whether the breaker closes
+                        due = due[:1]
+                    if later:
+                        wake_in = min(wake_in, min(later) - now)
+                    self._requeue(due)
+                self.outbox.sync(force=False)
             except Exception as e:
                 clog(logging.ERROR, "EMAIL", f"scan failed: {e}")
-            for _ in range(int(self.scan_interval * 10)):
-                if self.stop_event.is_set():
-                    break
-                time.sleep(0.1)
+            self._wake.wait(max(0.1, wake_in))
+            if self.stop_event.is_set() or self._draining.is_set():
+                break
+
+
+    def _requeue(self, due):
+        for _, _, job_id, data in due:
+            job = EmailJob.from_dict(job_id, data)
+            with self._inflight_lock:
+                self._inflight.add(job_id)
+            try:
+                self._enqueue(job)
+                clog(logging.DEBUG, "EMAIL",
+                     f"re-queued cached job (attempt {job.attempts + 1}): "
+                     f"{os.path.basename(job.screenshot_path) if job.screenshot_path else '(no attachment)'}")
+            except queue.Full:
+                with self._inflight_lock:
+                    self._inflight.discard(job_id)
+                clog(logging.WARNING, "EMAIL", "queue still full, keep cached")
+                break
+
+
+    def _backoff(self, attempts):
+        # Exponential backoff with jitter in [delay/2, delay].
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+
+    def _complete(self, job: EmailJob):
+        with self._inflight_lock:
+            journaled = job.id in self._inflight
+            self._inflight.discard(job.id)
+        if journaled:
+            self.outbox.done(job.id)
 
 
     def _cache_to_disk(self, job: EmailJob):
-        base = os.path.splitext(os.path.basename(job.screenshot_path))[
-            0] if job.screenshot_path else f"job_{int(time.time() * 1000)}"
-        meta_path = os.path.join(self.retry_dir, f"{base}.json")
-        data = {
-            "to_addr": job.to_addr,
-            "subject": job.subject,
-            "html_body": job.html_body,
-            "screenshot_path": job.screenshot_path,
-            "created_at": datetime.now().isoformat() + "Z"
-        }
+        # A failed attempt: journal the job with its backoff.
+        job.attempts += 1
+        delay = self._backoff(job.attempts)
+        self._defer(job, time.time() + delay)
+        clog(logging.INFO, "EMAIL", f"cached job to outbox, retry in {delay:.0f}s: {job.subject}")
+
+
+    def _defer(self, job: EmailJob, not_before):
+        with self._inflight_lock:
+            self._inflight.discard(job.id)
+        job.next_attempt_at = not_before
         try:
-            with open(meta_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            clog(logging.INFO, "EMAIL", f"cached job to disk: {os.path.basename(meta_path)}")
+            self.outbox.put(job.id, job.to_dict())
         except Exception as e:
-            clog(logging.ERROR, "EMAIL", f"failed to write cache meta: {e}")
+            clog(logging.ERROR, "EMAIL", f"failed to write outbox journal: {e}")
+        self._wake.set()
 
 
     def _send(self, job: EmailJob):
@@ -149,20 +402,108 @@ class EmailSender:
         msg.attach(alt)
 
         if job.screenshot_path and os.path.exists(job.screenshot_path):
+            subtype = os.path.splitext(job.screenshot_path)[1].lstrip(".").lower().replace("jpg", "jpeg") or None
             with open(job.screenshot_path, 'rb') as img:
-                msg_image = MIMEImage(img.read())
+                msg_image = MIMEImage(img.read(), _subtype=subtype)
                 msg_image.add_header('Content-ID', '<screenshot>')
                 msg_image.add_header('Content-Disposition', 'inline')
                 msg.attach(msg_image)
 
-        server = None
+        # Serialize once with CRLF line endings into a spooled file and stream it to the server from there,
+        # instead of holding the message object, its string form and smtplib's encoded copy at once.
+        with tempfile.SpooledTemporaryFile(max_size=1 << 20) as fp:
+            BytesGenerator(fp, policy=email.policy.SMTP).flatten(msg)
+            pooled = self._server is not None
+            try:
+                fp.seek(0)
+                _stream_mail(self._connection(), self.user, job.to_addr, fp)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self._close_connection()
+                if not pooled:
+                    raise
+                # Stale pooled session: reconnect once, then let the caller cache the job.
+                clog(logging.DEBUG, "EMAIL", "pooled SMTP session dropped (%s), reconnecting", e)
+                fp.seek(0)
+                _stream_mail(self._connection(), self.user, job.to_addr, fp)
+            except Exception:
+                self._close_connection()
+                raise
+        self._last_used = time.monotonic()
+
+
+    def _connection(self):
+        if self._server is None:
+            if self.use_ssl:
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=15)
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=15)
+            try:
+                if self.user and self.password:
+                    server.login(self.user, self.password)
+            except Exception:
+                try:
+                    server.close()
+                except Exception:
+                    pass
+                raise
+            self._server = server
+            self._last_used = self._last_noop = time.monotonic()
+            clog(logging.DEBUG, "EMAIL", "connected to %s:%s", self.host, self.port)
+        return self._server
+
+
+    def _close_connection(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
         try:
-            server = smtplib.SMTP_SSL('smtp.qq.com', 465, timeout=15)
-            server.login(self.user, self.password)
-            server.sendmail(self.user, job.to_addr, msg.as_string())
-        finally:
+            server.quit()
+        except Exception:
             try:
-                if server:
-                    server.quit()
+                server.close()
             except Exception:
                 pass
+
+
+    def _idle_tick(self):
+        # Close the pooled session after idle_timeout; until then keep it alive with NOOPs.
+        if self._server is None:
+            return
+        now = time.monotonic()
+        if now - self._last_used >= self.idle_timeout:
+            clog(logging.DEBUG, "EMAIL", "closing idle SMTP session")
+            self._close_connection()
+        elif now - self._last_noop >= self.keepalive:
+            self._last_noop = now
+            try:
+                code, _ = self._server.noop()
+                if code != 250:
+                    raise smtplib.SMTPServerDisconnected(f"NOOP returned {code}")
+            except Exception as e:
+                clog(logging.DEBUG, "EMAIL", "SMTP keepalive failed, dropping session: %s", e)
+                self._close_connection()
+
+
+def _stream_mail(server, from_addr, to_addr, fp):
+    # SMTP transaction fed line by line from a CRLF-serialized message file (RFC 5321 dot-stuffing applied).
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    code, resp = server.rcpt(to_addr)
+    if code not in (250, 251):
+        raise smtplib.SMTPRecipientsRefused({to_addr: (code, resp)})
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    last = b"\r\n"
+    for line in fp:
+        if line.startswith(b"."):
+            line = b"." + line
+        server.send(line)
+        last = line
+    server.send(b".\r\n" if last.endswith(b"\r\n") else b"\r\n.\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
@@ -0,0 +1,145 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_BIND, METRICS_PORT, METRICS_REFRESH
+from logutil import clog
+
+
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _esc(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_openmetrics(status):
+    # `status` is one session ({"stats", "metrics"}) or several under "sessions"; with several, every sample gets
+    # a session label and samples of one family stay grouped as OpenMetrics requires.
+    email = status.get("email") or {}
+    families = {}
+
+    def add(name, kind, labels, value, help_text=None, suffix=None):
+        # suffix defaults to "_total" for counters; summaries pass "" for quantiles and "_count"/"_sum"
+        if suffix is None:
+            suffix = "_total" if kind == "counter" else ""
+        families.setdefault(name, (kind, help_text, []))[2].append((suffix, labels, value))
+
+    for session in status.get("sessions") or [status]:
+        stats = session["stats"]
+        metrics = session["metrics"]
+        base = {"session": stats["session"]} if stats.get("session") else {}
+        for name, value in sorted(metrics["counters"].items()):
+            add(name, "counter", base, value)
+        add("sale_occurrences", "counter", base, stats["sale_occurrences"])
+        add("visits_per_minute", "gauge", base, stats["visits_per_min"])
+        add("first_sale_seen", "gauge", base, int(stats["first_sale_seen"]))
+        for name, h in sorted(metrics["histograms"].items()):
+            labels = dict(base, name=name[6:] if name.startswith("phase.") else name)
+            for q, key in ((0.5, "p50"), (0.9, "p90"), (0.99, "p99")):
+                add("latency_seconds", "summary", dict(labels, quantile=str(q)), h[key] / 1e6,
+                    "latency quantiles (phase timers, result latency, sale interval)")
+            add("latency_seconds", "summary", labels, h["count"], suffix="_count")
+            add("latency_seconds", "summary", labels, h.get("sum", 0) / 1e6, suffix="_sum")
+
+    if email:
+        add("email_queue_depth", "gauge", {}, email["queue_depth"])
+        add("email_outbox_pending", "gauge", {}, email["outbox_pending"])
+        add("email_breaker_open", "gauge", {}, int(email["breaker_open"]))
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        if help_text:
+            lines.append(f"# HELP autobuy_{name} {help_text}")
+        lines.append(f"# TYPE autobuy_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_str = ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items())
+            lines.append(f"autobuy_{name}{suffix}{{{label_str}}} {value}" if label_str
+                         else f"autobuy_{name}{suffix} {value}")
+    lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class StatusExporter:
+    # Serves /metrics (OpenMetrics) and /status (JSON) from a snapshot rebuilt every `refresh` seconds by its own
+    # thread, so scrapes only copy cached bytes and never reach into Stats or EmailSender.
+
+
+    def __init__(self, stats, email_sender=None, port=METRICS_PORT, bind=METRICS_BIND, refresh=METRICS_REFRESH):
+        self.stats = stats
+        self.email_sender = email_sender
+        self.port = port
+        self.bind = bind
+        self.refresh = refresh
+        self._cache = (b"{}", b"# EOF\n")
+        self._stop = threading.Event()
+        self._server = None
+        self._refresher = threading.Thread(target=self._refresh_loop, daemon=True, name="metrics-refresh")
+
+
+    def start(self):
+        self._rebuild()
+        exporter = self
+
+
+        class Handler(BaseHTTPRequestHandler):
+
+
+            def do_GET(self):
+                status_json, metrics_text = exporter._cache
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body, ctype = metrics_text, OPENMETRICS_TYPE
+                elif path in ("/", "/status"):
+                    body, ctype = status_json, "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def log_message(self, fmt, *args):
+                pass
+
+
+        self._server = ThreadingHTTPServer((self.bind, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+        self._refresher.start()
+        clog(logging.INFO, "STATS", f"metrics endpoint on http://{self.bind}:{self._server.server_address[1]}/metrics")
+
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+    def status(self):
+        # `stats` may be a list of labelled per-session Stats; a single Stats keeps the flat layout
+        if isinstance(self.stats, (list, tuple)):
+            status = {"sessions": [{"stats": st.snapshot(), "metrics": st.metrics.snapshot()} for st in self.stats]}
+        else:
+            status = {"stats": self.stats.snapshot(), "metrics": self.stats.metrics.snapshot()}
+        if self.email_sender is not None:
+            status["email"] = self.email_sender.status()
+        return status
+
+
+    def _rebuild(self):
+        status = self.status()
+        self._cache = (json.dumps(status, default=str).encode("utf-8"), render_openmetrics(status))
+
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh):
+            try:
+                self._rebuild()
+            except Exception as e:
+                clog(logging.ERROR, "STATS", f"metrics refresh failed: {e}")
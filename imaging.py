@@ -0,0 +1,32 @@
+import io
+
+from config import SCREENSHOT_FORMAT, SCREENSHOT_MAX_BYTES, SCREENSHOT_MAX_WIDTH
+
+
+_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def encode_screenshot(image, max_width=SCREENSHOT_MAX_WIDTH, max_bytes=SCREENSHOT_MAX_BYTES, fmt=SCREENSHOT_FORMAT,
+                      crop=None):
+    # Crop/downscale a PIL image and compress it under `max_bytes`, stepping quality down and then size.
+    # Returns (encoded bytes, file extension).
+    from PIL import Image
+
+    fmt = fmt.upper()
+    img = image.convert("RGB")
+    if crop:
+        img = img.crop(crop)
+    if max_width and img.width > max_width:
+        img = img.resize((max_width, max(1, round(img.height * max_width / img.width))), Image.BILINEAR)
+
+    data = b""
+    while True:
+        for quality in (85, 70, 55, 40):
+            buf = io.BytesIO()
+            img.save(buf, fmt, quality=quality, optimize=True)
+            data = buf.getvalue()
+            if not max_bytes or len(data) <= max_bytes:
+                return data, _EXTENSIONS.get(fmt, fmt.lower())
+        if img.width <= 320:
+            return data, _EXTENSIONS.get(fmt, fmt.lower())
+        img = img.resize((img.width * 3 // 4, img.height * 3 // 4), Image.BILINEAR)
@@ -0,0 +1,228 @@
+import contextlib
+import logging
+import queue
+import sys
+import threading
+import time
+
+from config import INPUT_BACKEND, WINDOW_FOCUS_DELAY
+from logutil import clog
+from tracing import span
+
+
+class KeyboardBackend:
+    # OS-level key events through the `keyboard` hook library; no per-call pause.
+
+
+    def __init__(self):
+        import keyboard
+        import pyautogui
+        pyautogui.FAILSAFE = True
+        self._keyboard = keyboard
+        self._pyautogui = pyautogui
+
+
+    def press(self, key):
+        # keep pyautogui's mouse-corner failsafe even though keys bypass it
+        self._pyautogui.failSafeCheck()
+        self._keyboard.press_and_release(key)
+
+
+class PyAutoGUIBackend:
+
+
+    def __init__(self):
+        import pyautogui
+        pyautogui.FAILSAFE = True
+        self._pyautogui = pyautogui
+
+
+    def press(self, key):
+        self._pyautogui.press(key, _pause=False)
+
+
+class FakeInputBackend:
+    # Records (monotonic_ts, key) instead of sending anything; used by replay runs and benchmarks.
+
+
+    def __init__(self):
+        self.keys = []
+        self._lock = threading.Lock()
+
+
+    def press(self, key):
+        with self._lock:
+            self.keys.append((time.monotonic(), key))
+
+
+class WindowInputBackend:
+    # Routes another backend's keys to one game window. Sessions share one process-wide lock: the dispatcher holds
+    # it for a whole macro pass (hold()), so the window is focused once and no other session's keys interleave.
+
+
+    _lock = threading.Lock()
+
+
+    def __init__(self, backend, title, focus_delay=WINDOW_FOCUS_DELAY):
+        import pygetwindow
+        self._gw = pygetwindow
+        self.backend = backend
+        self.title = title
+        self.focus_delay = focus_delay
+        # only the owning dispatcher thread presses through this backend
+        self._holding = False
+
+
+    def _focus(self):
+        active = self._gw.getActiveWindow()
+        if active is not None and active.title == self.title:
+            return
+        matches = self._gw.getWindowsWithTitle(self.title)
+        if not matches:
+            raise OSError(f"window {self.title!r} not found")
+        matches[0].activate()
+        time.sleep(self.focus_delay)
+
+
+    @contextlib.contextmanager
+    def hold(self):
+        with WindowInputBackend._lock:
+            self._focus()
+            self._holding = True
+            try:
+                yield
+            finally:
+                self._holding = False
+
+
+    def press(self, key):
+        if self._holding:
+            self.backend.press(key)
+            return
+        with WindowInputBackend._lock:
+            self._focus()
+            self.backend.press(key)
+
+
+def create_input_backend(kind=INPUT_BACKEND):
+    if kind == "fake":
+        return FakeInputBackend()
+    if kind == "keyboard":
+        # the keyboard hook can fail for reasons beyond a missing module (no input device, no permission);
+        # pyautogui is the fallback, and if that fails too there is no way to drive the game, so it raises
+        try:
+            return KeyboardBackend()
+        except Exception as e:
+            clog(logging.WARNING, "BUY", "keyboard backend unavailable (%s), falling back to pyautogui input", e)
+    return PyAutoGUIBackend()
+
+
+def is_failsafe(exc):
+    # pyautogui is imported lazily by the backends; if it never loaded, nothing could have tripped its failsafe.
+    pyautogui = sys.modules.get("pyautogui")
+    return pyautogui is not None and isinstance(exc, pyautogui.FailSafeException)
+
+
+class MacroRun:
+
+
+    def __init__(self, macro, repeat=False):
+        # macro: sequence of (key, min_gap_after_sec)
+        self.macro = tuple(macro)
+        self.repeat = repeat
+        self.sent = 0
+        self.error = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+
+    def cancel(self):
+        # Drop the remaining keys; a key already being sent still completes.
+        self._cancel.set()
+
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+
+    def wait(self, timeout=None):
+        finished = self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return finished
+
+
+class InputDispatcher:
+    # Sends key macros on a dedicated thread so detection never blocks on input gaps.
+
+
+    def __init__(self, backend=None, name="input-dispatcher"):
+        self.backend = backend or create_input_backend()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=name)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+    def send(self, macro, repeat=False):
+        run = MacroRun(macro, repeat=repeat)
+        self._queue.put(run)
+        return run
+
+
+    def send_until(self, macro, watcher, states, timeout=None, watch=(), repeat=False):
+        # Start `macro`, wait for the watcher to confirm `states`, then cut the macro short.
+        run = self.send(macro, repeat=repeat)
+        try:
+            return watcher.wait_for(states, timeout=timeout, watch=watch)
+        finally:
+            run.cancel()
+            run.wait()
+
+
+    def _loop(self):
+        while not self._stop.is_set():
+            run = self._queue.get()
+            if run is None:
+                break
+            try:
+                with span("macro"):
+                    self._play(run)
+            except Exception as e:
+                run.error = e
+                clog(logging.ERROR, "BUY", "input macro failed: %s", e)
+            finally:
+                run.finished_at = time.monotonic()
+                run._done.set()
+
+
+    def _play(self, run):
+        # Backends with hold() (window routing) keep exclusive input for one pass of the macro; repeating macros
+        # release it between passes so other sessions are not starved.
+        hold = getattr(self.backend, "hold", None)
+        while True:
+            with hold() if hold is not None else contextlib.nullcontext():
+                for key, gap in run.macro:
+                    if run.cancelled or self._stop.is_set():
+                        return
+                    with span("key"):
+                        self.backend.press(key)
+                    run.sent += 1
+                    if gap and run._cancel.wait(gap):
+                        return
+            if not run.repeat:
+                return
@@ -1,7 +1,12 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 
 from colorama import init as colorama_init, Fore, Style
 
+from config import LOG_FILE, LOG_FILE_BACKUPS, LOG_FILE_MAX_BYTES, LOG_LEVEL
+
 
 colorama_init(autoreset=True)
 
@@ -17,18 +22,21 @@ class ColorFormatter(logging.Formatter):
 
 
     def format(self, record):
+        # colored copies go in extra attributes so other handlers still see the plain record
         color = self.LEVEL_COLORS.get(record.levelno, "")
-        reset = Style.RESET_ALL
-        record.levelname = f"{color}{record.levelname}{reset}"
+        record.color_levelname = f"{color}{record.levelname}{Style.RESET_ALL}"
+        comp = getattr(record, "comp", None)
+        record.color_comp = f"{COMP_COLORS.get(comp, '')}[{comp}]{Style.RESET_ALL} " if comp else ""
         return super().format(record)
 
 
-logger = logging.getLogger("autobuy")
-logger.setLevel(logging.DEBUG)
-_handler = logging.StreamHandler()
-_handler.setFormatter(
-    ColorFormatter(fmt="%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s", datefmt="%H:%M:%S"))
-logger.addHandler(_handler)
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # Enqueue the record as-is: message interpolation and formatting happen on the listener thread.
+
+
+    def prepare(self, record):
+        return record
+
 
 COMP_COLORS = {
     "CORE": Fore.WHITE + Style.BRIGHT,
@@ -38,8 +46,40 @@ COMP_COLORS = {
     "STATS": Fore.CYAN + Style.BRIGHT,
 }
 
+logger = logging.getLogger("autobuy")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+
+_console = logging.StreamHandler()
+_console.setFormatter(ColorFormatter(fmt="%(asctime)s [%(color_levelname)s] [%(threadName)s] %(color_comp)s%(message)s",
+                                     datefmt="%H:%M:%S"))
+_sinks = [_console]
+if LOG_FILE:
+    _file = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS,
+                                                 encoding="utf-8")
+    _file.setFormatter(logging.Formatter(fmt="%(asctime)s [%(levelname)s] [%(threadName)s] [%(comp)s] %(message)s",
+                                         defaults={"comp": "-"}))
+    _sinks.append(_file)
+
+_queue = queue.SimpleQueue()
+logger.addHandler(_LazyQueueHandler(_queue))
+_listener = logging.handlers.QueueListener(_queue, *_sinks, respect_handler_level=True)
+_listener.start()
+
+
+def flush_logs():
+    # Drain and stop the listener; call before os._exit, which skips atexit hooks.
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(flush_logs)
+
 
-def clog(level, comp, msg):
-    c = COMP_COLORS.get(comp, "")
-    reset = Style.RESET_ALL
-    logger.log(level, f"{c}[{comp}]{reset} {msg}")
+def clog(level, comp, msg, *args):
+    # msg may use %-style placeholders filled from args on the listener thread; disabled levels cost one check.
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, msg, *args, extra={"comp": comp})
@@ -0,0 +1,222 @@
+import threading
+import time
+
+from tracing import record
+
+
+class Counter:
+    # Each thread increments its own cell; reads sum all cells. Writers never share state, so no lock on inc().
+
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+
+    def _cell(self):
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0]
+            self._local.cell = cell
+            with self._lock:
+                self._cells.append(cell)
+        return cell
+
+
+    def inc(self, n=1):
+        self._cell()[0] += n
+
+
+    @property
+    def value(self):
+        return sum(c[0] for c in list(self._cells))
+
+
+class Histogram:
+    # HDR-style log-linear histogram of non-negative integers (microseconds by convention): values below
+    # sub_buckets are exact, larger ones are bucketed by power of two and then into sub_buckets linear slots, so a
+    # bucket spans under 1/sub_buckets of its value. Quantiles report bucket midpoints.
+    # Counts are sharded per thread like Counter and merged on read.
+
+
+    def __init__(self, sub_bits=7, max_exp=40):
+        self.sub_bits = sub_bits
+        self.sub_buckets = 1 << sub_bits
+        # group 0 holds the exact values, group g >= 1 the values of bit length sub_bits + g
+        self.size = (max_exp - sub_bits + 1) * self.sub_buckets
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = [0] * self.size
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+
+    def _index(self, v):
+        if v < self.sub_buckets:
+            return v
+        exp = v.bit_length() - self.sub_bits - 1
+        return min((exp + 1) * self.sub_buckets + (v >> exp) - self.sub_buckets, self.size - 1)
+
+
+    def _lower(self, idx):
+        group, sub = divmod(idx, self.sub_buckets)
+        if group == 0:
+            return sub
+        return (self.sub_buckets + sub) << (group - 1)
+
+
+    def _mid(self, idx):
+        group = idx // self.sub_buckets
+        return self._lower(idx) + ((1 << (group - 1)) >> 1 if group else 0)
+
+
+    def record(self, v):
+        self._shard()[self._index(max(0, int(v)))] += 1
+
+
+    def merge(self, sparse):
+        # Add {bucket index: count} (as produced by sparse()) into the calling thread's shard.
+        shard = self._shard()
+        for i, c in sparse.items():
+            i = int(i)
+            if 0 <= i < self.size:
+                shard[i] += int(c)
+
+
+    def sparse(self):
+        return {i: c for i, c in enumerate(self.counts()) if c}
+
+
+    def counts(self):
+        merged = [0] * self.size
+        for shard in list(self._shards):
+            for i, c in enumerate(shard):
+                if c:
+                    merged[i] += c
+        return merged
+
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        # {"count", "sum", "max", "p50", ...} in recorded units (bucket midpoints)
+        counts = self.counts()
+        total = sum(counts)
+        out = {"count": total, "sum": sum(c * self._mid(i) for i, c in enumerate(counts) if c)}
+        if not total:
+            out.update({f"p{int(q * 100)}": 0 for q in quantiles}, max=0)
+            return out
+        targets = sorted((q, max(1, int(round(q * total)))) for q in quantiles)
+        seen, t = 0, 0
+        for i, c in enumerate(counts):
+            if not c:
+                continue
+            seen += c
+            while t < len(targets) and seen >= targets[t][1]:
+                out[f"p{int(targets[t][0] * 100)}"] = self._mid(i)
+                t += 1
+            out["max"] = self._mid(i)
+        return out
+
+
+class RateWindow:
+    # Events per second over the last `seconds`, in a fixed ring of one-second buckets. Intended for a single
+    # writer thread; readers may see a bucket mid-update, which is fine for reporting.
+
+
+    def __init__(self, seconds=300):
+        self.seconds = seconds
+        self._counts = [0] * seconds
+        self._stamps = [0] * seconds
+
+
+    def inc(self, n=1, now=None):
+        sec = int(now if now is not None else time.time())
+        i = sec % self.seconds
+        if self._stamps[i] != sec:
+            self._stamps[i] = sec
+            self._counts[i] = 0
+        self._counts[i] += n
+
+
+    def rate(self, now=None):
+        sec = int(now if now is not None else time.time())
+        lo = sec - self.seconds
+        total = sum(c for c, s in zip(self._counts, self._stamps) if lo < s <= sec)
+        return total / float(self.seconds)
+
+
+class _Timer:
+    # Records into a histogram and, when tracing is enabled, emits the same interval as a span.
+
+
+    __slots__ = ("hist", "name", "t0")
+
+
+    def __init__(self, hist, name):
+        self.hist = hist
+        self.name = name
+
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter_ns()
+        self.hist.record((t1 - self.t0) / 1000)
+        record(self.name, self.t0, t1)
+        return False
+
+
+class Metrics:
+
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.windows = {}
+        self._lock = threading.Lock()
+
+
+    def _get(self, table, name, factory):
+        m = table.get(name)
+        if m is None:
+            with self._lock:
+                m = table.get(name)
+                if m is None:
+                    m = table[name] = factory()
+        return m
+
+
+    def counter(self, name):
+        return self._get(self.counters, name, Counter)
+
+
+    def histogram(self, name):
+        return self._get(self.histograms, name, Histogram)
+
+
+    def window(self, name, seconds=300):
+        return self._get(self.windows, name, lambda: RateWindow(seconds))
+
+
+    def phase(self, name):
+        # with metrics.phase("wait_main"): ...  -> histogram "phase.wait_main" in microseconds
+        return _Timer(self.histogram(f"phase.{name}"), f"phase.{name}")
+
+
+    def snapshot(self):
+        return {
+            "counters": {n: c.value for n, c in list(self.counters.items())},
+            "histograms": {n: h.summary() for n, h in list(self.histograms.items())},
+            "rates": {n: w.rate() for n, w in list(self.windows.items())},
+        }
@@ -0,0 +1,141 @@
+import collections
+import logging
+import threading
+import time
+from string import Template
+
+from config import MAIL_USER, STATS_EMAIL_MIN_INTERVAL
+from emailer import PRIORITY_HIGH, EmailJob
+from logutil import clog
+from vision import get_frame_source
+
+
+# Compiled once; rendered with the snapshot dict plus a title.
+STATS_TABLE = Template("""
+    <h3>$title</h3>
+    <table border="1" cellpadding="6" cellspacing="0" style="border-collapse:collapse;">
+      <tr><th align="left">Timestamp</th><td>$timestamp</td></tr>
+      <tr><th align="left">No-sale visits (total)</th><td>$no_sale_visits</td></tr>
+      <tr><th align="left">Purchase attempts</th><td>$purchase_attempts</td></tr>
+      <tr><th align="left">Purchase failures</th><td>$purchase_failures</td></tr>
+      <tr><th align="left">Time to FIRST sale from start (s)</th><td>$time_to_first_sale_from_start_sec</td></tr>
+      <tr><th align="left">No-sale before FIRST sale</th><td>$no_sale_before_first_sale</td></tr>
+      <tr><th align="left">Avg sale interval (s)</th><td>$avg_sale_interval_sec</td></tr>
+      <tr><th align="left">Sale occurrences</th><td>$sale_occurrences</td></tr>
+      <tr><th align="left">First sale seen?</th><td>$first_sale_seen</td></tr>
+    </table>
+    """)
+
+MILESTONE_HEADER = Template("<h3>AutoBuy Stats Milestone</h3>\n    <p>Reached <b>$no_sale_visits</b> no-sale visits.$merged</p>")
+
+
+def render_stats_table(title, snapshot):
+    if snapshot.get("session"):
+        title = f"{title} — {snapshot['session']}"
+    return STATS_TABLE.safe_substitute(snapshot, title=title)
+
+
+def send_success_email_with_shot(email_sender, snapshot, region=None):
+    # Only the grab happens here; downscaling and compression run on the email encoder thread.
+    image = get_frame_source().grab(region).image
+
+    stats_html = render_stats_table("AutoBuy Stats (at success)", snapshot)
+
+    html = (
+            '<p>The car purchase was <b>successful</b>. See the screenshot below:</p>'
+            '<img src="cid:screenshot"><br><br>' + stats_html
+    )
+
+    subject = 'Car Purchase Successful'
+    if snapshot.get("session"):
+        subject += f" ({snapshot['session']})"
+    email_sender.send_async_with_image(EmailJob(
+        to_addr=MAIL_USER,
+        subject=subject,
+        html_body=html,
+        priority=PRIORITY_HIGH
+    ), image)
+
+
+class MilestoneNotifier:
+    # Single long-lived consumer for milestone events. push() never blocks: events land in a bounded deque
+    # (oldest dropped when full), and everything pending at send time is merged into one digest email, at most
+    # once per min_interval seconds.
+
+
+    def __init__(self, email_sender, to_addr=MAIL_USER, min_interval=STATS_EMAIL_MIN_INTERVAL, capacity=64):
+        self.email_sender = email_sender
+        self.to_addr = to_addr
+        self.min_interval = min_interval
+        self._pending = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._last_sent = None
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="stats-notifier")
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        # Whatever is still held back by the rate limit goes out as one final digest.
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+    def push(self, snapshot):
+        with self._cond:
+            self._pending.append(snapshot)
+            self._cond.notify()
+
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                stopping = self._stop
+                if self._last_sent is not None and not stopping:
+                    # rate limit; further pushes just accumulate meanwhile
+                    wait = self._last_sent + self.min_interval - time.monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                batch = list(self._pending)
+                self._pending.clear()
+            if batch:
+                self._last_sent = time.monotonic()
+                try:
+                    # queued before the email phase of shutdown, which delivers it or spills it to the outbox
+                    self.email_sender.send_async(self._digest(batch))
+                except Exception as e:
+                    clog(logging.ERROR, "STATS", f"milestone email failed: {e}")
+            if stopping:
+                return
+
+
+    def _digest(self, batch):
+        latest = batch[-1]
+        # one table per session, newest snapshot of each
+        by_session = {}
+        for snap in batch:
+            by_session[snap.get("session")] = snap
+        merged = ""
+        if len(batch) > 1:
+            merged = f" Merged {len(batch)} milestones: " + ", ".join(
+                f"{s['session']}:{s['no_sale_visits']}" if s.get("session") else str(s["no_sale_visits"])
+                for s in batch) + "."
+        html = (MILESTONE_HEADER.substitute(no_sale_visits=latest["no_sale_visits"], merged=merged)
+                + "".join(render_stats_table("Latest stats", snap) for snap in by_session.values()))
+        return EmailJob(
+            to_addr=self.to_addr,
+            subject=f"AutoBuy Stats — No-sale={latest['no_sale_visits']}",
+            html_body=html,
+            screenshot_path=None,
+        )
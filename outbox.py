@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from config import OUTBOX_COMPACT_MIN, OUTBOX_FSYNC_INTERVAL
+from logutil import clog
+
+
+class Outbox:
+    # Append-only journal of cached email jobs. Each line is {"op": "put", "id", "job"} or {"op": "done", "id"};
+    # the pending set is rebuilt from the journal at startup and kept in memory afterwards. Appends are fsynced in
+    # groups (every fsync_interval seconds or on sync()), and the file is rewritten with only pending jobs once
+    # dead records dominate.
+
+
+    def __init__(self, directory, name="outbox.journal", fsync_interval=OUTBOX_FSYNC_INTERVAL,
+                 compact_min=OUTBOX_COMPACT_MIN):
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        self.fsync_interval = fsync_interval
+        self.compact_min = compact_min
+        self._pending = {}
+        self._records = 0
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._migrate_legacy()
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+
+    def pending(self):
+        # {id: job dict}, oldest first
+        with self._lock:
+            return dict(self._pending)
+
+
+    def put(self, job_id, job):
+        self.put_many([(job_id, job)])
+
+
+    def put_many(self, items):
+        # items: iterable of (id, job dict); written as one append.
+        with self._lock:
+            lines = []
+            for job_id, job in items:
+                self._pending[job_id] = job
+                lines.append(json.dumps({"op": "put", "id": job_id, "job": job}, ensure_ascii=False))
+            self._append_unlocked(lines)
+
+
+    def done(self, job_id):
+        with self._lock:
+            if self._pending.pop(job_id, None) is None:
+                return
+            self._append_unlocked([json.dumps({"op": "done", "id": job_id})])
+
+
+    def sync(self, force=True):
+        with self._lock:
+            self._sync_unlocked(force)
+
+
+    def close(self):
+        with self._lock:
+            self._sync_unlocked(True)
+            self._fh.close()
+
+
+    def _append_unlocked(self, lines):
+        if not lines:
+            return
+        self._fh.write("\n".join(lines) + "\n")
+        self._records += len(lines)
+        self._dirty = True
+        self._sync_unlocked(False)
+        if self._records >= self.compact_min and self._records > 4 * len(self._pending):
+            self._compact_unlocked()
+
+
+    def _sync_unlocked(self, force):
+        if not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_sync < self.fsync_interval:
+            self._fh.flush()
+            return
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+
+    def _compact_unlocked(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for job_id, job in self._pending.items():
+                f.write(json.dumps({"op": "put", "id": job_id, "job": job}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._fh.close()
+        os.replace(tmp, self.path)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        clog(logging.DEBUG, "EMAIL", "outbox compacted: %d -> %d records", self._records, len(self._pending))
+        self._records = len(self._pending)
+        self._dirty = False
+
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                terminated = raw.endswith(b"\n")
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    # torn tail write from a crash (or a damaged line, which is skipped)
+                    if terminated:
+                        good += len(raw)
+                    continue
+                good += len(raw)
+                self._records += 1
+                if rec.get("op") == "put":
+                    self._pending[rec["id"]] = rec["job"]
+                elif rec.get("op") == "done":
+                    self._pending.pop(rec["id"], None)
+                if not terminated:
+                    # complete record that lost its newline: terminate it so the next append starts a fresh line
+                    with open(self.path, "ab") as out:
+                        out.write(b"\n")
+                    good += 1
+        if good < os.path.getsize(self.path):
+            # cut the torn fragment so the next append does not glue onto it
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+        if self._pending:
+            clog(logging.INFO, "EMAIL", f"outbox: {len(self._pending)} pending job(s) from previous runs")
+
+
+    def _migrate_legacy(self):
+        # One-off import of the old one-JSON-file-per-job cache.
+        items, paths = [], []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    items.append((f"legacy-{os.path.splitext(name)[0]}", json.load(f)))
+                paths.append(meta_path)
+            except (OSError, ValueError) as e:
+                clog(logging.WARNING, "EMAIL", f"skipping unreadable cache file {name}: {e}")
+        if not items:
+            return
+        self.put_many(items)
+        self.sync()
+        for p in paths:
+            os.remove(p)
+        clog(logging.INFO, "EMAIL", f"outbox: migrated {len(items)} legacy cached job(s)")
@@ -0,0 +1,98 @@
+import logging
+import time
+
+from config import (PREDICT_BUCKET_MIN, PREDICT_DEDUPE_SEC, PREDICT_IDLE_DELAY, PREDICT_IDLE_WATCH_MS,
+                    PREDICT_MIN_SALES, WATCH_INTERVAL_MS)
+from logutil import clog
+
+
+class SalePredictor:
+    # Model of when listings appear, rebuilt from Stats.sale_history whenever it grows. Two signals:
+    #  - interval: time since the last listing falls inside the [p10, p90] band of past listing intervals
+    #  - time of day: the current bucket of the day has seen at least an average share of listings
+    # Either one puts us "in window". With too little history we are always in window.
+
+
+    def __init__(self, stats, min_sales=PREDICT_MIN_SALES, dedupe_sec=PREDICT_DEDUPE_SEC,
+                 bucket_min=PREDICT_BUCKET_MIN):
+        self.stats = stats
+        self.min_sales = min_sales
+        self.dedupe_sec = dedupe_sec
+        self.bucket_sec = bucket_min * 60
+        self.buckets = max(1, 86400 // self.bucket_sec)
+        self._seen = None
+        self._listings = []
+        self._band = None
+        self._hot = set()
+
+
+    def _refresh(self):
+        history = self.stats.sale_history
+        # keyed on the newest sighting: once drain_sale_events() trims the history its length stops changing
+        key = (len(history), history[-1] if history else None)
+        if key == self._seen:
+            return
+        self._seen = key
+        # consecutive sightings of the same listing on successive visits count once
+        listings = []
+        for ts in sorted(history):
+            if not listings or ts - listings[-1] > self.dedupe_sec:
+                listings.append(ts)
+        self._listings = listings
+        if len(listings) < self.min_sales:
+            self._band, self._hot = None, set()
+            return
+
+        intervals = sorted(b - a for a, b in zip(listings, listings[1:]))
+        lo = intervals[int(0.1 * (len(intervals) - 1))]
+        hi = intervals[int(round(0.9 * (len(intervals) - 1)))]
+        # widen a little so a tight history doesn't produce a knife-edge window
+        self._band = (lo * 0.9 - 30, hi * 1.1 + 30)
+
+        counts = [0] * self.buckets
+        for ts in listings:
+            counts[self._bucket(ts)] += 1
+        mean = len(listings) / float(self.buckets)
+        self._hot = {i for i, c in enumerate(counts) if c and c >= mean}
+        clog(logging.DEBUG, "STATS", "predictor: %d listings, interval band %.0f-%.0fs, %d/%d hot time-of-day buckets",
+             len(listings), lo, hi, len(self._hot), self.buckets)
+
+
+    def _bucket(self, ts):
+        lt = time.localtime(ts)
+        return ((lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec) // self.bucket_sec) % self.buckets
+
+
+    def in_window(self, now=None):
+        now = now if now is not None else time.time()
+        self._refresh()
+        if self._band is None:
+            return True
+        since = now - self._listings[-1]
+        lo, hi = self._band
+        return lo <= since <= hi or self._bucket(now) in self._hot
+
+
+class AdaptiveScheduler:
+    # Full speed inside predicted windows; outside them, pause between visits and sample the screen less often.
+
+
+    def __init__(self, predictor, watcher, idle_delay=PREDICT_IDLE_DELAY, fast_ms=WATCH_INTERVAL_MS,
+                 idle_ms=PREDICT_IDLE_WATCH_MS):
+        self.predictor = predictor
+        self.watcher = watcher
+        self.idle_delay = idle_delay
+        self.fast = fast_ms / 1000.0
+        self.idle = idle_ms / 1000.0
+        self._hot = None
+
+
+    def before_visit(self):
+        # Returns the delay to wait before the next visit and sets the watcher's sampling interval.
+        hot = self.predictor.in_window()
+        if hot != self._hot:
+            self._hot = hot
+            self.watcher.interval = self.fast if hot else self.idle
+            clog(logging.INFO, "STATS", "entering predicted sale window, full refresh rate" if hot
+                 else "outside predicted sale windows, slowing down")
+        return 0.0 if hot else self.idle_delay
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import RECORDER_DUMP_DIR, RECORDER_FILE, RECORDER_FPS, RECORDER_SCALE, RECORDER_SECONDS
+from logutil import clog
+from vision import get_frame_source
+
+
+class FrameRecorder:
+    # Keeps the last `seconds` of downscaled full-screen frames in a fixed memory-mapped ring buffer.
+    # Dumps are written by the recorder thread itself, so callers on the hot path only set a flag.
+
+
+    def __init__(self, seconds=RECORDER_SECONDS, fps=RECORDER_FPS, scale=RECORDER_SCALE, path=RECORDER_FILE,
+                 dump_dir=RECORDER_DUMP_DIR, source=None):
+        self.capacity = max(1, int(seconds * fps))
+        self.interval = 1.0 / fps
+        self.scale = max(1, int(scale))
+        self.path = path
+        self.dump_dir = dump_dir
+        self.source = source
+        self._frames = None
+        self._ts = np.zeros(self.capacity, dtype=np.float64)
+        self._count = 0
+        self._dumps = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="frame-recorder")
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def dump(self, reason="manual"):
+        # Request a dump of the current window; returns immediately.
+        with self._lock:
+            self._dumps.append(reason)
+
+
+    def _allocate(self, height, width):
+        h, w = -(-height // self.scale), -(-width // self.scale)
+        self._frames = np.memmap(self.path, dtype=np.uint8, mode="w+", shape=(self.capacity, h, w, 3))
+        clog(logging.INFO, "CORE", f"recorder ring: {self.capacity} frames of {w}x{h} "
+                                   f"({self._frames.nbytes / 1e6:.1f} MB) in {self.path}")
+
+
+    def _record(self):
+        frame = (self.source or get_frame_source()).grab()
+        arr = frame.array
+        if self._frames is None:
+            self._allocate(*arr.shape[:2])
+        slot = self._count % self.capacity
+        np.copyto(self._frames[slot], arr[::self.scale, ::self.scale])
+        self._ts[slot] = time.time()
+        self._count += 1
+
+
+    def _write_dump(self, reason):
+        if not self._count:
+            return
+        n = min(self._count, self.capacity)
+        start = self._count - n
+        order = [(start + i) % self.capacity for i in range(n)]
+        os.makedirs(self.dump_dir, exist_ok=True)
+        out = os.path.join(self.dump_dir, f"{reason}_{int(time.time() * 1000)}.npz")
+        # Replayable with ReplaySource / bench.py
+        np.savez_compressed(out, frames=self._frames[order], ts=self._ts[order], scale=self.scale)
+        clog(logging.INFO, "CORE", f"recorder dumped {n} frames to {out}")
+
+
+    def _loop(self):
+        next_t = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self._record()
+            except Exception as e:
+                clog(logging.WARNING, "CORE", "recorder capture failed: %s", e)
+            with self._lock:
+                dumps, self._dumps = self._dumps, []
+            for reason in dumps:
+                try:
+                    self._write_dump(reason)
+                except Exception as e:
+                    clog(logging.ERROR, "CORE", f"recorder dump failed: {e}")
+            next_t += self.interval
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_t = time.monotonic()
+        if self._frames is not None:
+            self._frames.flush()
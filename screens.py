@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+
+from config import SCREENS_FILE
+from logutil import clog
+from vision import Probe, ProbeSet
+
+
+# Screen signatures, transitions and key macros for the auction-house loop.
+# probes: {name: [x, y, [r, g, b]]}, optionally with a 4th element {radius, tol, min_fraction, max_mean_dist}
+# overriding the table's "probe_defaults"; match: "all"/"any"; next: possible successor screens;
+# watch: screens sampled alongside the successors; actions: {name: [[key, gap_after_sec], ...]}
+# A rig-specific table can declare a "BUY_FAILED" screen and list it in BUY_READY's "next" so failed purchases are
+# recognised immediately instead of at PURCHASE_RESULT_TIMEOUT.
+# reference: display geometry the coordinates were taken on; anchors: probes used to locate the UI at calibration
+DEFAULT_TABLE = {
+    "reference": {"width": 2560, "height": 1440},
+    "anchors": ["main"],
+    "states": {
+        "MAIN": {
+            "probes": {"main": [1900, 420, [247, 247, 247]]},
+            "next": ["NO_LAG"],
+            "watch": ["ON_SALE"],
+            "actions": {"enter_auction": [["enter", 0.5], ["enter", 0.5]]},
+        },
+        "NO_LAG": {
+            "probes": {"no_lag": [1678, 701, [255, 255, 255]],
+                       "no_lag_alt": [2360, 476, [247, 247, 247]]},
+            "match": "any",
+            "next": ["MAIN"],
+            "actions": {"leave": [["esc", 0.0]]},
+        },
+        "ON_SALE": {
+            "probes": {"on_sale": [1000, 325, [247, 247, 247]]},
+            "next": ["BUY_PROMPT"],
+        },
+        "BUY_PROMPT": {
+            "probes": {"buy_prompt": [700, 1330, [21, 9, 21]]},
+            "next": ["BUY_READY"],
+            "actions": {"open": [["y", 0.5]]},
+        },
+        "BUY_READY": {
+            "probes": {"buy_ready": [1700, 885, [247, 247, 247]]},
+            "next": ["BUY_SUCCESS"],
+            "actions": {"buy": [["down", 0.2], ["enter", 0.2], ["enter", 0.2]],
+                        "abort": [["esc", 0.5], ["esc", 0.5]],
+                        "dismiss_failure": [["enter", 0.5], ["esc", 0.5], ["esc", 0.5]]},
+        },
+        "BUY_SUCCESS": {
+            "probes": {"buy_success": [1559, 772, [247, 247, 247]]},
+            "next": [],
+            "actions": {"finish": [["enter", 0.5], ["esc", 0.5], ["esc", 1.5],
+                                   ["right", 0.5], ["down", 0.5], ["enter", 0.0]]},
+        },
+    }
+}
+
+
+class Screen:
+
+
+    def __init__(self, probes, match="all"):
+        # probes: {name: (x, y, (r, g, b))}; match: "all" or "any" of the probes must hit
+        if match not in ("all", "any"):
+            raise ValueError(f"unknown match mode: {match!r}")
+        self.probes = dict(probes)
+        self.match = match
+
+
+    def evaluate(self, results):
+        hits = (results[name] for name in self.probes)
+        return all(hits) if self.match == "all" else any(hits)
+
+
+class ScreenTable:
+
+
+    def __init__(self, table, transform=None):
+        self.spec = table
+        self.transform = transform
+        ref = table.get("reference", {})
+        self.reference = (int(ref.get("width", 0)), int(ref.get("height", 0)))
+        self.anchors = tuple(table.get("anchors", ()))
+        states = table["states"]
+        self.screens = {}
+        self.successors = {}
+        self.watched = {}
+        self.actions = {}
+        for name, spec in states.items():
+            probes = {}
+            for p, entry in spec["probes"].items():
+                x, y, color = entry[:3]
+                opts = dict(table.get("probe_defaults", {}))
+                if len(entry) > 3:
+                    opts.update(entry[3])
+                if transform is not None:
+                    x, y = transform.apply(x, y)
+                    if "radius" in opts:
+                        opts["radius"] = max(0, int(round(opts["radius"] * min(transform.sx, transform.sy))))
+                probes[p] = Probe(x, y, color, **opts)
+            self.screens[name] = Screen(probes, spec.get("match", "all"))
+            self.successors[name] = tuple(spec.get("next", ()))
+            self.watched[name] = tuple(spec.get("watch", ()))
+            self.actions[name] = {a: tuple((str(k), float(gap)) for k, gap in keys)
+                                  for a, keys in spec.get("actions", {}).items()}
+
+        for name in states:
+            for other in self.successors[name] + self.watched[name]:
+                if other not in self.screens:
+                    raise ValueError(f"screen {name!r} references unknown screen {other!r}")
+
+        # ProbeSets per combination of screens, built on first use
+        self._probe_sets = {}
+
+
+    def transformed(self, transform):
+        return ScreenTable(self.spec, transform)
+
+
+    def probe(self, name):
+        # Reference-space probe by name, as declared in the table.
+        for spec in self.spec["states"].values():
+            if name in spec["probes"]:
+                x, y, color = spec["probes"][name][:3]
+                return int(x), int(y), tuple(int(c) for c in color)
+        raise KeyError(name)
+
+
+    def probe_set(self, states):
+        key = frozenset(states)
+        ps = self._probe_sets.get(key)
+        if ps is None:
+            probes = {}
+            for s in states:
+                probes.update(self.screens[s].probes)
+            ps = ProbeSet(probes)
+            self._probe_sets[key] = ps
+        return ps
+
+
+    def macro(self, state, action):
+        return self.actions[state][action]
+
+
+def load_screen_table(path=SCREENS_FILE):
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        clog(logging.INFO, "DETECT", f"loaded screen table from {path}")
+    else:
+        table = DEFAULT_TABLE
+    return ScreenTable(table)
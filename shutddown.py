@@ -1,53 +1,123 @@
 import logging
 import os
 import signal
+import sys
 import threading
 import time
 
-import keyboard
+import tracing
+from config import SHUTDOWN_DEADLINE, SHUTDOWN_DETECT_BUDGET, SHUTDOWN_EMAIL_BUDGET, TRACE_FILE
+from logutil import clog, flush_logs
 
-from logutil import clog
 
+class _Registry:
+    # Everything that must be wound down on exit; one entry per session for Stats, stores and detection loops.
 
-_stats_ref = None
-_email_sender_ref = None
+
+    def __init__(self):
+        self.loops = []
+        self.stats = []
+        self.stores = []
+        self.email_senders = []
+
+
+_refs = _Registry()
 _EXITING = False
 _LOCK = threading.Lock()
+_watchdog = None
+_exit_thread = None
+
+
+def register_refs(stats=None, email_sender=None, store=None, loops=()):
+    # loops: watchers, input dispatchers, recorder, notifier... anything with stop() (and optionally join())
+    # that produces work; they are stopped first.
+    with _LOCK:
+        _refs.loops.extend(loop for loop in loops if loop is not None)
+        if stats is not None:
+            _refs.stats.append(stats)
+        if store is not None:
+            _refs.stores.append(store)
+        if email_sender is not None and email_sender not in _refs.email_senders:
+            _refs.email_senders.append(email_sender)
 
 
-def inject_refs(stats, email_sender):
-    global _stats_ref, _email_sender_ref
-    _stats_ref = stats
-    _email_sender_ref = email_sender
+def _force_exit():
+    clog(logging.ERROR, "CORE", "Shutdown exceeded %ss, forcing exit.", SHUTDOWN_DEADLINE)
+    flush_logs()
+    os._exit(1)
 
 
 def _cleanup_and_exit():
-    global _EXITING
+    # Phased shutdown, each phase on its own budget and the whole under a watchdog:
+    # stop detection -> deliver queued email -> spill the rest to the outbox -> checkpoint Stats -> exit.
+    global _EXITING, _watchdog, _exit_thread
     with _LOCK:
-        if _EXITING:
-            return
-        _EXITING = True
-    try:
-        keyboard.unhook_all()
-    except Exception:
-        pass
-
-    try:
-        if _stats_ref:
-            _stats_ref.stop()
-    except Exception:
-        pass
+        first = not _EXITING
+        if first:
+            _EXITING = True
+            _exit_thread = threading.get_ident()
+            _watchdog = threading.Timer(SHUTDOWN_DEADLINE, _force_exit)
+            _watchdog.daemon = True
+            _watchdog.name = "shutdown-watchdog"
+            _watchdog.start()
+    if not first:
+        # a second trigger (F12 plus a signal, or main_loop returning) waits for the first one to exit; on the
+        # shutting-down thread itself (a signal handler interrupting the cleanup) waiting would only stall it
+        if threading.get_ident() != _exit_thread:
+            _watchdog.join()
+        return
+    t0 = time.monotonic()
+
+    # keyboard is only loaded once hotkeys were registered
+    keyboard = sys.modules.get("keyboard")
     try:
-        if _email_sender_ref:
-            _email_sender_ref.shutdown(wait_seconds=5.0)
+        if keyboard is not None:
+            keyboard.unhook_all()
     except Exception:
         pass
 
-    clog(logging.INFO, "CORE", ">>> Exiting now...")
-    try:
-        time.sleep(0.1)
-    except Exception:
-        pass
+    for loop in _refs.loops:
+        try:
+            loop.stop()
+        except Exception:
+            pass
+    deadline = time.monotonic() + SHUTDOWN_DETECT_BUDGET
+    for loop in _refs.loops:
+        join = getattr(loop, "join", None)
+        try:
+            if join is not None:
+                join(max(0.0, deadline - time.monotonic()))
+        except Exception:
+            pass
+
+    deadline = time.monotonic() + SHUTDOWN_EMAIL_BUDGET
+    for email_sender in _refs.email_senders:
+        try:
+            email_sender.shutdown(wait_seconds=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            clog(logging.ERROR, "CORE", "email shutdown failed: %s", e)
+
+    for stats in _refs.stats:
+        try:
+            stats.stop()
+        except Exception:
+            pass
+    for store in _refs.stores:
+        try:
+            store.stop()
+            store.checkpoint()
+        except Exception as e:
+            clog(logging.ERROR, "CORE", "stats checkpoint failed: %s", e)
+
+    if tracing.enabled():
+        try:
+            clog(logging.INFO, "CORE", "wrote %d trace events to %s", tracing.export_chrome(TRACE_FILE), TRACE_FILE)
+        except Exception as e:
+            clog(logging.ERROR, "CORE", "trace export failed: %s", e)
+
+    clog(logging.INFO, "CORE", ">>> Exiting now (shutdown took %.1fs)...", time.monotonic() - t0)
+    # os._exit skips atexit, so drain the log queue explicitly
+    flush_logs()
     os._exit(0)
 
 
@@ -58,6 +128,7 @@ def hard_kill():
 
 
 def register_hotkeys_and_signals():
+    import keyboard
     keyboard.add_hotkey("f12", hard_kill, suppress=True)
 
 
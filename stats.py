@@ -4,31 +4,46 @@ import time
 from datetime import datetime
 
 from logutil import clog
+from metrics import Metrics
+from tracing import summary_line
 
 
 class Stats:
 
 
-    def __init__(self, log_interval_sec=30, milestone=300, milestone_cb=None):
-        self.no_sale_visits = 0
-        self.purchase_attempts = 0
-        self.purchase_failures = 0
+    def __init__(self, log_interval_sec=30, milestone=300, milestone_cb=None, failure_cb=None, label=None):
+        # `label` names the session when one process runs several; it tags snapshots and log lines.
+        self.label = label
+        # Hot-path counts go to per-thread metric shards; the lock only guards the rare sale-timing fields.
+        self.metrics = Metrics()
+        self._no_sale = self.metrics.counter("no_sale_visits")
+        self._attempts = self.metrics.counter("purchase_attempts")
+        self._failures = self.metrics.counter("purchase_failures")
+        self._no_sale_before_first = self.metrics.counter("no_sale_before_first_sale")
+        self._result_timeouts = self.metrics.counter("result_timeouts")
+        self._visits = self.metrics.window("visits")
+        self._result_latency = self.metrics.histogram("result_latency")
+        self._sale_interval = self.metrics.histogram("sale_interval")
+        self._result_latency_last = None
 
         self._program_start_ts = time.time()
         self._first_sale_ts = None
         self._time_to_first_sale_from_start_sec = None
-        self._no_sale_before_first_sale = 0
 
         self._sale_occurrences = 0
         self._last_sale_ts = None
+        # Sale sighting timestamps: full (bounded) history, plus those not yet written to the event log
+        self.sale_history = []
+        self._new_sales = []
 
         self._lock = threading.Lock()
         self._log_interval = log_interval_sec
         self._stop = threading.Event()
-        self._thread = threading.Thread(target=self._loop, daemon=True, name="stats-reporter")
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"stats-{label}" if label else "stats-reporter")
 
         self._milestone = milestone
         self._milestone_cb = milestone_cb
+        self._failure_cb = failure_cb
 
 
     def start(self):
@@ -39,36 +54,61 @@ class Stats:
         self._stop.set()
 
 
-    def mark_enter_main(self):
-        pass
+    @property
+    def no_sale_visits(self):
+        return self._no_sale.value
 
 
-    def mark_no_sale(self):
-        snapshot_for_cb = None
-        reached = False
-        with self._lock:
-            self.no_sale_visits += 1
+    @property
+    def purchase_attempts(self):
+        return self._attempts.value
+
+
+    @property
+    def purchase_failures(self):
+        return self._failures.value
+
+
+    def phase(self, name):
+        # Times a main_loop phase: with stats.phase("wait_main"): ...
+        return self.metrics.phase(name)
+
+
+    def record_phase(self, name, seconds):
+        self.metrics.histogram(f"phase.{name}").record(seconds * 1e6)
+
+
+    def mark_enter_main(self):
+        self._visits.inc()
 
-            if self._first_sale_ts is None:
-                self._no_sale_before_first_sale += 1
 
-            if self._milestone and self.no_sale_visits % self._milestone == 0:
-                snapshot_for_cb = self._snapshot_unlocked()
-                reached = True
+    def mark_no_sale(self):
+        self._no_sale.inc()
+        if self._first_sale_ts is None:
+            self._no_sale_before_first.inc()
 
-        if reached and self._milestone_cb:
-            threading.Thread(target=self._milestone_cb, args=(snapshot_for_cb,),
-                             daemon=True, name="stats-milestone-cb").start()
+        # called inline on the detection thread, so the callback must not block (see MilestoneNotifier.push)
+        if self._milestone and self._milestone_cb and self.no_sale_visits % self._milestone == 0:
+            self._milestone_cb(self.snapshot())
 
 
     def mark_purchase_attempt(self):
-        with self._lock:
-            self.purchase_attempts += 1
+        self._attempts.inc()
 
 
     def mark_purchase_failure(self):
-        with self._lock:
-            self.purchase_failures += 1
+        self._failures.inc()
+        if self._failure_cb:
+            self._failure_cb()
+
+
+    def mark_purchase_result(self, latency_sec):
+        # latency_sec is None when no result screen was seen before the timeout
+        if latency_sec is None:
+            self._result_timeouts.inc()
+            return
+        self._result_latency.record(latency_sec * 1e6)
+        self._result_latency_last = latency_sec
 
 
     def mark_first_sale_seen(self):
@@ -77,9 +117,63 @@ class Stats:
             if self._first_sale_ts is None:
                 self._first_sale_ts = now
                 self._time_to_first_sale_from_start_sec = now - self._program_start_ts
+            else:
+                self._sale_interval.record((now - self._last_sale_ts) * 1e6)
 
             self._sale_occurrences += 1
             self._last_sale_ts = now
+            self.sale_history.append(now)
+            self._new_sales.append(now)
+
+
+    # Persisted counters and histograms (see StatsStore)
+    _PERSISTED_COUNTERS = ("no_sale_visits", "purchase_attempts", "purchase_failures", "no_sale_before_first_sale",
+                           "result_timeouts")
+    _PERSISTED_HISTOGRAMS = ("result_latency", "sale_interval")
+
+
+    def export_state(self):
+        with self._lock:
+            return {
+                # 2: histogram buckets use the full-octave layout; older bucket indices are not comparable
+                "version": 2,
+                "saved_at": time.time(),
+                "counters": {n: self.metrics.counter(n).value for n in self._PERSISTED_COUNTERS},
+                "histograms": {n: self.metrics.histogram(n).sparse() for n in self._PERSISTED_HISTOGRAMS},
+                "program_start_ts": self._program_start_ts,
+                "first_sale_ts": self._first_sale_ts,
+                "time_to_first_sale_from_start_sec": self._time_to_first_sale_from_start_sec,
+                "sale_occurrences": self._sale_occurrences,
+                "last_sale_ts": self._last_sale_ts,
+                "last_result_latency_sec": self._result_latency_last,
+            }
+
+
+    def restore_state(self, state, sale_history=()):
+        # Called once at startup, before the loop runs.
+        with self._lock:
+            for n, v in state.get("counters", {}).items():
+                if n in self._PERSISTED_COUNTERS:
+                    self.metrics.counter(n).inc(int(v))
+            for n, sparse in state.get("histograms", {}).items():
+                if n in self._PERSISTED_HISTOGRAMS and state.get("version", 1) >= 2:
+                    self.metrics.histogram(n).merge(sparse)
+            self._program_start_ts = state.get("program_start_ts") or self._program_start_ts
+            self._first_sale_ts = state.get("first_sale_ts")
+            self._time_to_first_sale_from_start_sec = state.get("time_to_first_sale_from_start_sec")
+            self._sale_occurrences = int(state.get("sale_occurrences", 0))
+            self._last_sale_ts = state.get("last_sale_ts")
+            self._result_latency_last = state.get("last_result_latency_sec")
+            self.sale_history = list(sale_history)
+
+
+    def drain_sale_events(self, keep=None):
+        # Sales recorded since the last call; optionally trims the in-memory history to the last `keep`.
+        with self._lock:
+            new, self._new_sales = self._new_sales, []
+            if keep and len(self.sale_history) > keep:
+                del self.sale_history[:-keep]
+            return new
 
 
     def snapshot(self):
@@ -94,29 +188,57 @@ class Stats:
         else:
             avg_sale_interval = 0.0
 
+        result_latency = self._result_latency.summary()
+        sale_interval = self._sale_interval.summary()
+        phases = {}
+        for name, hist in list(self.metrics.histograms.items()):
+            if name.startswith("phase."):
+                h = hist.summary()
+                phases[name[6:]] = {"count": h["count"], "p50_ms": round(h["p50"] / 1000.0, 1),
+                                    "p99_ms": round(h["p99"] / 1000.0, 1)}
+
         return {
             "no_sale_visits": self.no_sale_visits,
             "purchase_attempts": self.purchase_attempts,
             "purchase_failures": self.purchase_failures,
             "time_to_first_sale_from_start_sec": round(self._time_to_first_sale_from_start_sec or 0.0, 2),
-            "no_sale_before_first_sale": int(self._no_sale_before_first_sale),
+            "no_sale_before_first_sale": self._no_sale_before_first.value,
             "avg_sale_interval_sec": round(avg_sale_interval, 2),
             "sale_occurrences": self._sale_occurrences,
             "first_sale_seen": self._first_sale_ts is not None,
+            "result_latency_p50_sec": round(result_latency["p50"] / 1e6, 3),
+            "result_latency_p99_sec": round(result_latency["p99"] / 1e6, 3),
+            "last_result_latency_sec": round(self._result_latency_last or 0.0, 3),
+            "result_timeouts": self._result_timeouts.value,
+            "sale_interval_p50_sec": round(sale_interval["p50"] / 1e6, 1),
+            "sale_interval_p90_sec": round(sale_interval["p90"] / 1e6, 1),
+            "visits_per_min": round(self._visits.rate() * 60, 2),
+            "phase_latency_ms": phases,
+            "session": self.label,
             "timestamp": datetime.now().isoformat()
         }
 
 
     def _loop(self):
         while not self._stop.is_set():
+            since = time.perf_counter_ns()
             time.sleep(self._log_interval)
             snap = self.snapshot()
+            phases = " ".join(f"{name}={p['p50_ms']}/{p['p99_ms']}ms"
+                              for name, p in snap["phase_latency_ms"].items())
+            # process-wide span totals over this log interval (empty unless TRACE_ENABLED)
+            trace = summary_line(since)
             clog(logging.INFO, "STATS",
+                 (f"[{self.label}] " if self.label else "") +
                  f"no_sale={snap['no_sale_visits']} "
                  f"attempts={snap['purchase_attempts']} "
                  f"failures={snap['purchase_failures']} "
                  f"time_to_first_sale_from_start={snap['time_to_first_sale_from_start_sec']}s "
                  f"no_sale_before_first_sale={snap['no_sale_before_first_sale']} "
                  f"avg_sale_interval={snap['avg_sale_interval_sec']}s "
+                 f"result_latency_p50={snap['result_latency_p50_sec']}s "
+                 f"visits_per_min={snap['visits_per_min']} "
                  f"(occurrences={snap['sale_occurrences']}, first_sale_seen={snap['first_sale_seen']})"
+                 + (f" phases(p50/p99) {phases}" if phases else "")
+                 + (f" trace: {trace}" if trace else "")
                  )
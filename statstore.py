@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+
+from config import STATS_CHECKPOINT_INTERVAL, STATS_EVENTS_FILE, STATS_EVENTS_KEEP, STATS_STATE_FILE
+from logutil import clog
+
+
+class StatsStore:
+    # Persists Stats across restarts: a full-state checkpoint (write temp, fsync, rename) plus an append-only log of
+    # sale sightings, one epoch timestamp per line. Everything is written by the "stats-checkpoint" thread; the
+    # event log is compacted to the newest `keep_events` entries once it holds twice that many.
+
+
+    def __init__(self, stats, state_path=STATS_STATE_FILE, events_path=STATS_EVENTS_FILE,
+                 interval=STATS_CHECKPOINT_INTERVAL, keep_events=STATS_EVENTS_KEEP):
+        self.stats = stats
+        self.state_path = state_path
+        self.events_path = events_path
+        self.interval = interval
+        self.keep_events = keep_events
+        self._events_on_disk = 0
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="stats-checkpoint")
+
+
+    def load(self):
+        state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                clog(logging.WARNING, "STATS", f"stats checkpoint unreadable, starting fresh: {e}")
+        self._repair_events_tail()
+        events = self._read_events()
+        self._events_on_disk = len(events)
+        if state or events:
+            self.stats.restore_state(state, events[-self.keep_events:])
+            clog(logging.INFO, "STATS", f"restored stats checkpoint ({len(events)} sale events on record)")
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def checkpoint(self):
+        with self._io_lock:
+            new = self.stats.drain_sale_events(keep=self.keep_events)
+            if new:
+                with open(self.events_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{ts:.3f}\n" for ts in new))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._events_on_disk += len(new)
+            if self._events_on_disk > 2 * self.keep_events:
+                self._compact_events()
+            _atomic_write_json(self.state_path, self.stats.export_state())
+
+
+    def _repair_events_tail(self):
+        # An unterminated last line is a torn write from a crash (a cut-off timestamp may still parse, wrongly).
+        # Cut it so the next append starts on a fresh line instead of gluing onto it.
+        if not os.path.exists(self.events_path):
+            return
+        with open(self.events_path, "r+b") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+
+    def _read_events(self):
+        if not os.path.exists(self.events_path):
+            return []
+        events = []
+        with open(self.events_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(float(line))
+                except ValueError:
+                    # torn tail write from a crash
+                    continue
+        return events
+
+
+    def _compact_events(self):
+        keep = self._read_events()[-self.keep_events:]
+        tmp = self.events_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(f"{ts:.3f}\n" for ts in keep))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.events_path)
+        clog(logging.DEBUG, "STATS", "sale event log compacted: %d -> %d", self._events_on_disk, len(keep))
+        self._events_on_disk = len(keep)
+
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                clog(logging.ERROR, "STATS", f"stats checkpoint failed: {e}")
+
+
+def _atomic_write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
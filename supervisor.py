@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import threading
+from time import sleep
+
+from bot import run_until_success
+from calibration import calibrate
+from config import (METRICS_PORT, RECORDER_SECONDS, SESSIONS_FILE, STATS_LOG_INTERVAL, STATS_MILESTONE,
+                    require_mail_credentials)
+from inputs import InputDispatcher, WindowInputBackend, create_input_backend, is_failsafe
+from logutil import clog
+from predictor import AdaptiveScheduler, SalePredictor
+from recorder import FrameRecorder
+from screens import load_screen_table
+from shutddown import register_hotkeys_and_signals, register_refs, _cleanup_and_exit
+from stats import Stats
+from statstore import StatsStore
+from vision import SharedCapture, get_frame_source, set_frame_source
+from watcher import ScreenWatcher
+
+
+# Runs several game sessions from one process. sessions.json:
+#
+#   {"sessions": [
+#       {"name": "left", "region": [0, 0, 1280, 720], "window": "Forza Horizon 5 - A"},
+#       {"name": "right", "region": [1280, 0, 1280, 720], "window": "Forza Horizon 5 - B"}
+#   ]}
+#
+# "region" (left, top, width, height) is where that game is drawn; it defaults to the whole display. "window" is the
+# title of the window that receives the session's keys. Optional per-session "screens", "calibration", "state_file"
+# and "events_file" override the shared defaults. All sessions share one capture per tick, one EmailSender and one
+# milestone notifier; each keeps its own Stats, labelled with its name.
+
+
+class Session:
+
+
+    def __init__(self, spec, email_sender, notifier, failure_cb=None):
+        self.name = spec["name"]
+        self.region = tuple(spec["region"]) if spec.get("region") else None
+        self.window = spec.get("window")
+        self.email_sender = email_sender
+        self.result = None
+
+        self.stats = Stats(log_interval_sec=STATS_LOG_INTERVAL,
+                           milestone=STATS_MILESTONE,
+                           milestone_cb=notifier.push if notifier else None,
+                           failure_cb=failure_cb,
+                           label=self.name)
+        self.store = StatsStore(self.stats,
+                                state_path=spec.get("state_file", f"stats_state.{self.name}.json"),
+                                events_path=spec.get("events_file", f"sale_events.{self.name}.log"))
+
+        table = load_screen_table(spec["screens"]) if spec.get("screens") else load_screen_table()
+        self.table = calibrate(table, path=spec.get("calibration", f"calibration.{self.name}.json"),
+                               region=self.region)
+        self.watcher = ScreenWatcher(self.table, name=f"watcher-{self.name}")
+
+        backend = create_input_backend()
+        if self.window:
+            backend = WindowInputBackend(backend, self.window)
+        self.dispatcher = InputDispatcher(backend, name=f"input-{self.name}")
+        self.scheduler = AdaptiveScheduler(SalePredictor(self.stats), self.watcher)
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"session-{self.name}")
+
+
+    def start(self):
+        self.store.load()
+        self.store.start()
+        self.stats.start()
+        self.watcher.start()
+        self.dispatcher.start()
+        register_refs(self.stats, store=self.store, loops=(self.watcher, self.dispatcher))
+        self._thread.start()
+
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+    def _run(self):
+        try:
+            self.result = run_until_success(self.table, self.watcher, self.dispatcher, self.stats, self.scheduler)
+        except Exception as e:
+            if is_failsafe(e):
+                clog(logging.WARNING, "CORE", "PyAutoGUI FailSafe triggered in session %s — stopping.", self.name)
+                _cleanup_and_exit()
+                return
+            clog(logging.ERROR, "CORE", "session %s crashed: %s", self.name, e)
+        finally:
+            self.watcher.stop()
+            self.dispatcher.stop()
+        if self.result != "success":
+            return
+
+        sleep(8)
+        snap = self.stats.snapshot()
+        clog(logging.INFO, "STATS", "[%s] SUCCESS snapshot: time_to_first_sale_from_start=%ss, "
+                                    "no_sale_before_first_sale=%s, avg_sale_interval=%ss (occurrences=%s)",
+             self.name, snap["time_to_first_sale_from_start_sec"], snap["no_sale_before_first_sale"],
+             snap["avg_sale_interval_sec"], snap["sale_occurrences"])
+        if self.email_sender is not None:
+            from notifier import send_success_email_with_shot
+            send_success_email_with_shot(self.email_sender, snap, self.region)
+        self.stats.stop()
+        self.store.stop()
+        self.store.checkpoint()
+
+
+def load_sessions(path=SESSIONS_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        specs = json.load(f)["sessions"]
+    names = [s["name"] for s in specs]
+    if not specs or len(set(names)) != len(names):
+        raise ValueError(f"{path}: sessions need unique names")
+    return specs
+
+
+def supervise(specs, no_email=False):
+    # One physical capture per tick serves every session's watcher.
+    set_frame_source(SharedCapture(get_frame_source()))
+
+    email_sender = notifier = None
+    if not no_email:
+        require_mail_credentials()
+        from emailer import EmailSender
+        from notifier import MilestoneNotifier
+        email_sender = EmailSender()
+        email_sender.start()
+        notifier = MilestoneNotifier(email_sender)
+        notifier.start()
+
+    recorder = None
+    if RECORDER_SECONDS > 0:
+        recorder = FrameRecorder()
+        recorder.start()
+    failure_cb = (lambda: recorder.dump("purchase_failure")) if recorder else None
+
+    sessions = [Session(spec, email_sender, notifier, failure_cb) for spec in specs]
+    register_refs(email_sender=email_sender, loops=(recorder, notifier))
+    for session in sessions:
+        session.start()
+
+    if METRICS_PORT:
+        from exporter import StatusExporter
+        StatusExporter([s.stats for s in sessions], email_sender).start()
+
+    register_hotkeys_and_signals()
+    clog(logging.INFO, "CORE", "Supervising %d session(s): %s. Press F12 at any time to stop.",
+         len(sessions), ", ".join(s.name for s in sessions))
+
+    pending = list(sessions)
+    while pending:
+        pending = [s for s in pending if not s.join(0.5)]
+    clog(logging.INFO, "CORE", "All sessions finished: %s",
+         ", ".join(f"{s.name}={s.result}" for s in sessions))
+    _cleanup_and_exit()
+
+
+# -------------------- Entry Point --------------------
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run several AutoBuy sessions from one process.")
+    ap.add_argument("sessions", nargs="?", default=SESSIONS_FILE, help="sessions JSON file")
+    ap.add_argument("--no-email", "--dry-run", dest="no_email", action="store_true",
+                    help="run without the email pipeline; no SMTP credentials needed")
+    args = ap.parse_args()
+    try:
+        supervise(load_sessions(args.sessions), no_email=args.no_email)
+    except KeyboardInterrupt:
+        _cleanup_and_exit()
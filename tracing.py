@@ -0,0 +1,205 @@
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import TRACE_BUFFER, TRACE_ENABLED
+
+
+# Opt-in span tracing for the visit loop. Spans are written into a preallocated ring (oldest overwritten),
+# summarized into the Stats log line and exported as Chrome trace-event JSON (chrome://tracing, Perfetto).
+# Disabled, span() returns a shared no-op context manager and record() returns at once.
+#
+# Writers claim a slot from an atomic counter and fill it without locking; only the high-water mark of written
+# slots is advanced under the lock. A reader racing a writer may see one half-written span, which is acceptable
+# for diagnostics.
+#
+#   with span("capture"):
+#       frame = source.grab(region)
+
+
+class Tracer:
+
+
+    def __init__(self, capacity=TRACE_BUFFER):
+        self.capacity = capacity
+        # plain preallocated lists: a list store is several times cheaper than a NumPy scalar store, and readers
+        # convert the whole ring at once
+        self._start = [0] * capacity
+        self._dur = [0] * capacity
+        self._name = [0] * capacity
+        self._tid = [0] * capacity
+        self._slots = itertools.count()
+        self._written = 0
+        self._names = []
+        self._name_ids = {}
+        self._threads = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # trace timestamps are perf_counter_ns; this maps them onto the epoch for export metadata
+        self.epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+
+    def _name_id(self, name):
+        i = self._name_ids.get(name)
+        if i is None:
+            with self._lock:
+                i = self._name_ids.get(name)
+                if i is None:
+                    i = len(self._names)
+                    self._names.append(name)
+                    self._name_ids[name] = i
+        return i
+
+
+    def _thread_id(self):
+        tid = getattr(self._local, "tid", None)
+        if tid is None:
+            with self._lock:
+                tid = len(self._threads)
+                self._threads.append(threading.current_thread().name)
+            self._local.tid = tid
+        return tid
+
+
+    def record(self, name, start_ns, end_ns):
+        n = next(self._slots)
+        i = n % self.capacity
+        self._start[i] = start_ns
+        self._dur[i] = end_ns - start_ns
+        self._name[i] = self._name_id(name)
+        self._tid[i] = self._thread_id()
+        # two writers finishing out of order must not move the mark backwards
+        with self._lock:
+            if n >= self._written:
+                self._written = n + 1
+
+
+    def spans(self):
+        # (start_ns, dur_ns, name_ids, tids) of the retained spans, oldest first
+        n = self._written
+        if n <= self.capacity:
+            idx = np.arange(n)
+        else:
+            idx = (np.arange(self.capacity) + n) % self.capacity
+        return (np.array(self._start, dtype=np.int64)[idx], np.array(self._dur, dtype=np.int64)[idx],
+                np.array(self._name, dtype=np.int64)[idx], np.array(self._tid, dtype=np.int64)[idx])
+
+
+    def summary(self, since_ns=0):
+        # {name: (count, total_ms, mean_ms, max_ms)} for spans that started at or after since_ns
+        start, dur, names, _ = self.spans()
+        keep = start >= since_ns
+        dur, names = dur[keep], names[keep]
+        if not dur.size:
+            return {}
+        k = len(self._names)
+        counts = np.bincount(names, minlength=k)
+        totals = np.bincount(names, weights=dur, minlength=k)
+        maxes = np.zeros(k, dtype=np.int64)
+        np.maximum.at(maxes, names, dur)
+        return {self._names[i]: (int(counts[i]), totals[i] / 1e6, totals[i] / counts[i] / 1e6, maxes[i] / 1e6)
+                for i in np.flatnonzero(counts)}
+
+
+    def export_chrome(self, path):
+        start, dur, names, tids = self.spans()
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in enumerate(list(self._threads))]
+        for s, d, n, t in zip(start.tolist(), dur.tolist(), names.tolist(), tids.tolist()):
+            events.append({"name": self._names[n], "ph": "X", "ts": s / 1000.0, "dur": d / 1000.0,
+                           "pid": pid, "tid": t})
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"epoch_offset_ns": self.epoch_offset_ns}}, f)
+        os.replace(tmp, path)
+        return len(events)
+
+
+class _Span:
+
+
+    __slots__ = ("tracer", "name", "t0")
+
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.t0, time.perf_counter_ns())
+        return False
+
+
+class _NullSpan:
+
+
+    __slots__ = ()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_tracer = Tracer() if TRACE_ENABLED else None
+
+
+def enable(capacity=TRACE_BUFFER):
+    # Turn tracing on at runtime (bench --trace); spans already opened while disabled stay untraced.
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(capacity)
+    return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name):
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name)
+
+
+def record(name, start_ns, end_ns):
+    if _tracer is not None:
+        _tracer.record(name, start_ns, end_ns)
+
+
+def summary_line(since_ns=0, top=6):
+    # "capture 0.42ms x1500 (3.1%), ..." by total time, share of the wall time since since_ns; "" when disabled
+    if _tracer is None:
+        return ""
+    stats = _tracer.summary(since_ns)
+    if not stats:
+        return ""
+    wall_ms = max(1e-6, (time.perf_counter_ns() - since_ns) / 1e6) if since_ns else None
+    parts = []
+    for name, (count, total, mean, _) in sorted(stats.items(), key=lambda kv: -kv[1][1])[:top]:
+        share = f" ({100.0 * total / wall_ms:.1f}%)" if wall_ms else ""
+        parts.append(f"{name} {mean:.2f}ms x{count}{share}")
+    return ", ".join(parts)
+
+
+def export_chrome(path):
+    # Returns the number of events written, or 0 when tracing is disabled.
+    if _tracer is None:
+        return 0
+    return _tracer.export_chrome(path)
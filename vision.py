@@ -1,13 +1,409 @@
+import abc
+import glob
+import logging
+import os
+import threading
 import time
 
-import pyautogui
+import numpy as np
+
+from config import (FRAME_SOURCE, PROBE_MIN_FRACTION, PROBE_RADIUS, PROBE_TOLERANCE, REPLAY_DIR, REPLAY_FPS,
+                    SHARED_CAPTURE_MAX_AGE_MS)
+from logutil import clog
+from tracing import span
+
+
+class Probe:
+
+
+    def __init__(self, x, y, color, radius=PROBE_RADIUS, tol=PROBE_TOLERANCE, min_fraction=PROBE_MIN_FRACTION,
+                 max_mean_dist=None):
+        # A (2*radius+1)^2 pixel square centred on (x, y). A pixel matches when every channel is within `tol`;
+        # the probe hits when at least `min_fraction` of its pixels match and, if set, the mean RGB distance to
+        # `color` is at most `max_mean_dist`.
+        self.x = int(x)
+        self.y = int(y)
+        self.color = tuple(int(c) for c in color)
+        self.radius = int(radius)
+        self.tol = int(tol)
+        self.min_fraction = float(min_fraction)
+        self.max_mean_dist = max_mean_dist
+
+
+    @classmethod
+    def coerce(cls, p):
+        return p if isinstance(p, Probe) else cls(*p)
+
+
+class ProbeSet:
+    # Precomputes flat pixel indices for every probe so one capture is matched in a single vectorized pass.
+
+
+    def __init__(self, probes):
+        # probes: {name: Probe or (x, y, (r, g, b))}
+        if not probes:
+            raise ValueError("ProbeSet needs at least one probe")
+        self.probes = {name: Probe.coerce(p) for name, p in probes.items()}
+        plist = list(self.probes.values())
+        left = max(0, min(p.x - p.radius for p in plist))
+        top = max(0, min(p.y - p.radius for p in plist))
+        right = max(p.x + p.radius for p in plist)
+        bottom = max(p.y + p.radius for p in plist)
+        self.region = (left, top, right - left + 1, bottom - top + 1)
+
+        xs, ys, expected, tols, counts = [], [], [], [], []
+        for p in plist:
+            r = np.arange(-p.radius, p.radius + 1)
+            gy, gx = np.meshgrid(p.y + r, p.x + r, indexing="ij")
+            keep = (gx >= left) & (gy >= top)
+            gx, gy = gx[keep], gy[keep]
+            xs.append(gx - left)
+            ys.append(gy - top)
+            expected.append(np.broadcast_to(np.array(p.color, dtype=np.int16), (gx.size, 3)))
+            tols.append(np.full(gx.size, p.tol, dtype=np.int16))
+            counts.append(gx.size)
+        self._xs = np.concatenate(xs)
+        self._ys = np.concatenate(ys)
+        self._expected = np.concatenate(expected)
+        self._tols = np.concatenate(tols)
+        self._counts = np.array(counts, dtype=np.float64)
+        self._starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self._min_fraction = np.array([p.min_fraction for p in plist])
+        self._max_mean_dist = np.array([np.inf if p.max_mean_dist is None else p.max_mean_dist for p in plist])
+        self._use_dist = any(p.max_mean_dist is not None for p in plist)
+        self._names = list(self.probes)
+
+
+    def evaluate(self, frame):
+        # Returns {name: bool}; `frame` must cover self.region.
+        arr = frame.array
+        ox, oy = self.region[0] - frame.left, self.region[1] - frame.top
+        pix = arr[self._ys + oy, self._xs + ox].astype(np.int16)
+        diff = np.abs(pix - self._expected)
+        ok = (diff.max(axis=1) <= self._tols).astype(np.float64)
+        hit = np.add.reduceat(ok, self._starts) / self._counts >= self._min_fraction
+        if self._use_dist:
+            dist = np.sqrt((diff.astype(np.float64) ** 2).sum(axis=1))
+            hit &= np.add.reduceat(dist, self._starts) / self._counts <= self._max_mean_dist
+        return dict(zip(self._names, hit.tolist()))
+
+
+class Frame:
+
+
+    def __init__(self, image=None, left=0, top=0, array=None):
+        # Backed by a PIL image or an (H, W, 3) RGB array; the other form is built lazily.
+        self._image = image
+        self._array = array
+        self.left = left
+        self.top = top
+
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.asarray(self._image)[..., :3]
+        return self._array
+
+
+    @property
+    def image(self):
+        if self._image is None:
+            from PIL import Image
+            self._image = Image.fromarray(np.ascontiguousarray(self._array))
+        return self._image
+
+
+    def pixel(self, x, y):
+        # x, y are screen coordinates
+        return tuple(int(c) for c in self.array[y - self.top, x - self.left])
+
+
+class FrameSource(abc.ABC):
+
+
+    @abc.abstractmethod
+    def grab(self, region=None):
+        # region: (left, top, width, height) in screen coordinates, None for the full screen
+        ...
+
+
+    @abc.abstractmethod
+    def size(self):
+        # (width, height) of the captured display in capture pixels
+        ...
+
+
+    def close(self):
+        pass
+
+
+class PyAutoGUISource(FrameSource):
+
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+
+    def grab(self, region=None):
+        img = self._pyautogui.screenshot(region=region)
+        left, top = (region[0], region[1]) if region else (0, 0)
+        return Frame(img, left, top)
+
+
+    def size(self):
+        return tuple(self._pyautogui.size())
+
+
+class MssSource(FrameSource):
+    # mss handles are not thread-safe, so each thread keeps its own persistent session.
+
+
+    def __init__(self):
+        import mss
+        import mss.exception
+        self._mss = mss
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+
+    def _session(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = self._mss.mss()
+            self._local.sct = sct
+            with self._lock:
+                self._sessions.append(sct)
+        return sct
+
+
+    def grab(self, region=None):
+        sct = self._session()
+        if region is None:
+            mon = sct.monitors[1]
+            box = {"left": mon["left"], "top": mon["top"], "width": mon["width"], "height": mon["height"]}
+        else:
+            box = {"left": region[0], "top": region[1], "width": region[2], "height": region[3]}
+        try:
+            shot = sct.grab(box)
+        except self._mss.exception.ScreenShotError as e:
+            raise OSError(str(e)) from e
+        # BGRA buffer viewed as RGB without a copy
+        bgra = np.frombuffer(shot.bgra, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        return Frame(array=bgra[..., 2::-1], left=box["left"], top=box["top"])
+
+
+    def size(self):
+        mon = self._session().monitors[1]
+        return mon["width"], mon["height"]
+
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for sct in sessions:
+            try:
+                sct.close()
+            except Exception:
+                pass
+
+
+class ReplaySource(FrameSource):
+    # Plays back a recording: a directory of full-screen PNGs or an .npz archive with "frames" (N, H, W, 3) and
+    # optional "ts" (seconds). With timestamps (or fps) frames follow the wall clock from the first grab, scaled by
+    # `speed`; otherwise each grab consumes one frame. The last frame is held at the end unless `loop` is set.
+
+
+    def __init__(self, path, loop=False, fps=0, speed=1.0):
+        self.loop = loop
+        self.speed = speed
+        self._frames = None
+        self.paths = None
+        ts = None
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                self._frames = data["frames"]
+                ts = data["ts"] if "ts" in data.files else None
+            count = len(self._frames)
+        else:
+            self.paths = sorted(glob.glob(os.path.join(path, "*.png")))
+            count = len(self.paths)
+        if not count:
+            raise ValueError(f"no frames found in {path!r}")
+        if ts is None and fps:
+            ts = np.arange(count) / float(fps)
+        self.ts = None if ts is None else np.asarray(ts, dtype=np.float64) - float(ts[0])
+        self.count = count
+        self.index = 0
+        self.finished = False
+        self._t0 = None
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+
+    def _advance(self):
+        with self._lock:
+            if self.ts is not None:
+                now = time.monotonic()
+                if self._t0 is None:
+                    self._t0 = now
+                elapsed = (now - self._t0) * self.speed
+                if self.loop:
+                    elapsed %= self.ts[-1] + (self.ts[-1] / max(1, self.count - 1))
+                self.index = min(int(np.searchsorted(self.ts, elapsed, side="right")) - 1, self.count - 1)
+                self.finished = not self.loop and elapsed >= self.ts[-1]
+                return self.index
+            idx = self.index
+            if self.index + 1 < self.count:
+                self.index += 1
+            elif self.loop:
+                self.index = 0
+            else:
+                self.finished = True
+            return idx
+
+
+    def frame_time(self, idx):
+        # Wall-clock time at which frame `idx` was (or will be) presented, or None before playback starts.
+        if self.ts is None or self._t0 is None:
+            return None
+        return self._t0 + self.ts[idx] / self.speed
+
+
+    def load(self, idx):
+        if self._frames is not None:
+            return self._frames[idx]
+        cached_idx, arr = self._cached
+        if cached_idx != idx:
+            from PIL import Image
+            with Image.open(self.paths[idx]) as img:
+                arr = np.asarray(img.convert("RGB"))
+            self._cached = (idx, arr)
+        return arr
+
+
+    def grab(self, region=None):
+        arr = self.load(self._advance())
+        if region is None:
+            return Frame(array=arr)
+        left, top, width, height = region
+        return Frame(array=arr[top:top + height, left:left + width], left=left, top=top)
+
+
+    def size(self):
+        h, w = self.load(self.index).shape[:2]
+        return w, h
+
+
+class SharedCapture(FrameSource):
+    # Lets several watchers share one physical capture per tick. Each region grab is cropped from the last
+    # capture when that is younger than `max_age` and covers the region; otherwise the union of every region
+    # requested in the last `keep` seconds is captured once, under the lock, so concurrent callers reuse it.
+
+
+    def __init__(self, source, max_age=SHARED_CAPTURE_MAX_AGE_MS / 1000.0, keep=1.0):
+        self.source = source
+        self.max_age = max_age
+        self.keep = keep
+        self.captures = 0
+        self._wanted = {}
+        self._frame = None
+        self._at = 0.0
+        self._lock = threading.Lock()
+
+
+    def grab(self, region=None):
+        if region is None:
+            return self.source.grab()
+        now = time.monotonic()
+        with self._lock:
+            self._wanted[threading.get_ident()] = (region, now)
+            frame = self._frame
+            if frame is None or now - self._at > self.max_age or not _covers(frame, region):
+                boxes = [r for r, t in self._wanted.values() if now - t <= self.keep]
+                frame = self.source.grab(_union(boxes))
+                self._frame, self._at = frame, now
+                self.captures += 1
+        left, top, width, height = region
+        y, x = top - frame.top, left - frame.left
+        return Frame(array=frame.array[y:y + height, x:x + width], left=left, top=top)
+
+
+    def size(self):
+        return self.source.size()
+
+
+    def close(self):
+        self.source.close()
+
+
+def _covers(frame, region):
+    h, w = frame.array.shape[:2]
+    left, top, width, height = region
+    return (left >= frame.left and top >= frame.top
+            and left + width <= frame.left + w and top + height <= frame.top + h)
+
+
+def _union(regions):
+    left = min(r[0] for r in regions)
+    top = min(r[1] for r in regions)
+    right = max(r[0] + r[2] for r in regions)
+    bottom = max(r[1] + r[3] for r in regions)
+    return left, top, right - left, bottom - top
+
+
+def create_frame_source(kind=FRAME_SOURCE, replay_dir=REPLAY_DIR):
+    if kind == "replay":
+        return ReplaySource(replay_dir, fps=REPLAY_FPS)
+    if kind == "mss":
+        try:
+            return MssSource()
+        except ImportError:
+            clog(logging.WARNING, "DETECT", "mss not installed, falling back to pyautogui capture")
+    return PyAutoGUISource()
+
+
+_source = None
+_source_lock = threading.Lock()
+
+
+def get_frame_source():
+    global _source
+    if _source is None:
+        with _source_lock:
+            if _source is None:
+                _source = create_frame_source()
+    return _source
+
+
+def set_frame_source(source):
+    global _source
+    with _source_lock:
+        old, _source = _source, source
+    if old is not None and old is not source:
+        old.close()
 
 
 def check_color(x, y, color):
     # Check if the color at a specific screen position matches the given color.
     try:
-        px = pyautogui.screenshot(region=(x, y, 1, 1)).getpixel((0, 0))
-        return px == color
+        with span("capture"):
+            frame = get_frame_source().grab((x, y, 1, 1))
+        return frame.pixel(x, y) == color
     except OSError:
         time.sleep(0.05)
         return False
+
+
+def check_probes(probe_set):
+    # Grab the bounding box of every probe once and evaluate them all against that single capture.
+    try:
+        with span("capture"):
+            frame = get_frame_source().grab(probe_set.region)
+    except OSError:
+        time.sleep(0.05)
+        return {name: False for name in probe_set.probes}
+    with span("match"):
+        return probe_set.evaluate(frame)
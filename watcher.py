@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+from config import WATCH_INTERVAL_MS
+from logutil import clog
+from tracing import span
+from vision import check_probes
+
+
+class ScreenWatcher:
+    # Samples only the screens somebody is waiting on, and wakes waiters on the first tick that matches.
+
+
+    def __init__(self, table, interval_sec=WATCH_INTERVAL_MS / 1000.0, name="screen-watcher"):
+        self.table = table
+        self.screens = table.screens
+        self.interval = interval_sec
+        self._cond = threading.Condition()
+        self._interest = {}
+        self._matched = frozenset()
+        self._gen = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=name)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+
+    def sample(self, states):
+        # One synchronous evaluation of the given screens; returns the set that matched.
+        states = _as_tuple(states)
+        results = check_probes(self.table.probe_set(states))
+        return frozenset(s for s in states if self.screens[s].evaluate(results))
+
+
+    def wait_for(self, states, timeout=None, watch=()):
+        # Block until any of `states` is on screen. `watch` screens are sampled in the same frames so the
+        # caller can inspect them in the returned set. Returns None on timeout.
+        states = _as_tuple(states)
+        interest = states + tuple(s for s in _as_tuple(watch) if s not in states)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            for s in interest:
+                self._interest[s] = self._interest.get(s, 0) + 1
+            self._cond.notify_all()
+            gen = self._gen
+            try:
+                while not self._stop.is_set():
+                    if self._gen > gen and self._matched.intersection(states):
+                        return self._matched
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+                return None
+            finally:
+                for s in interest:
+                    self._interest[s] -= 1
+                    if not self._interest[s]:
+                        del self._interest[s]
+
+
+    def wait_next(self, state, timeout=None):
+        # Wait for any declared successor of `state`, sampling its watched screens in the same frames.
+        return self.wait_for(self.table.successors[state], timeout=timeout, watch=self.table.watched[state])
+
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._interest and not self._stop.is_set():
+                    self._cond.wait()
+                states = tuple(self._interest)
+            if self._stop.is_set():
+                break
+            t0 = time.monotonic()
+            try:
+                with span("watch.sample"):
+                    matched = self.sample(states)
+            except Exception as e:
+                clog(logging.ERROR, "DETECT", "watcher sample failed: %s", e)
+                matched = frozenset()
+            with self._cond:
+                self._matched = matched
+                self._gen += 1
+                self._cond.notify_all()
+            slack = self.interval - (time.monotonic() - t0)
+            if slack > 0:
+                with span("watch.slack"):
+                    self._stop.wait(slack)
+
+
+def _as_tuple(states):
+    return (states,) if isinstance(states, str) else tuple(states)